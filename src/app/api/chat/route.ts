@@ -1,25 +1,48 @@
 import { NextResponse } from "next/server";
 import { Pinecone } from "@pinecone-database/pinecone";
-import fs from "fs";
-import path from "path";
 import { adminDb } from "@/lib/firebaseAdmin";
 
-// Pinecone Setup
+// Pinecone Setup; PINECONE_HOST points the data plane at a specific index host,
+// e.g. the local stand-in (src/data/Preprocessing/pinecone_local.py)
 const pc = new Pinecone({ apiKey: process.env.PINECONE_API_KEY! });
-const index = pc.Index(process.env.PINECONE_INDEX!);
-
-// Load JSON Chunks into Memory
-const chunksFile = path.join(
-  process.cwd(),
-  "src",
-  "data",
-  "processed",
-  "all_product_chunks.json"
-);
-const chunksData: { chunk_id: string; metadata: any }[] = JSON.parse(
-  fs.readFileSync(chunksFile, "utf-8")
-);
-const chunkMap = new Map(chunksData.map((c) => [c.chunk_id, c]));
+const index = pc.Index(process.env.PINECONE_INDEX!, process.env.PINECONE_HOST);
+
+// Chunk payloads come from the embedding service's chunk store, projected to
+// the fields used for the context. Product chunks carry their fields under
+// "metadata"; preprocessed chunks (exclusions, add-ons, branches...) carry a
+// chunk type, text and "raw_data"
+type Chunk = {
+  chunk_id: string;
+  metadata?: any;
+  chunk_type?: string;
+  company_id?: string;
+  text?: string;
+  raw_data?: any;
+};
+const chunkFields = [
+  "chunk_id",
+  "metadata",
+  "chunk_type",
+  "company_id",
+  "text",
+  "raw_data",
+];
+
+// Helper: Render one chunk for the context
+function renderChunk(c: Chunk, i: number): string {
+  if (c.metadata) {
+    return `Result ${i + 1}:\nChunk ID: ${c.chunk_id}\nMetadata:\n${JSON.stringify(
+      c.metadata,
+      null,
+      2
+    )}`;
+  }
+  return (
+    `Result ${i + 1}:\nChunk ID: ${c.chunk_id}\nType: ${c.chunk_type}\n` +
+    `Company ID: ${c.company_id}\nText: ${c.text}\n` +
+    `Data:\n${JSON.stringify(c.raw_data, null, 2)}`
+  );
+}
 
 // Helper: Get MiniLM Embedding
 async function getMiniLMEmbedding(text: string): Promise<number[]> {
@@ -37,6 +60,75 @@ async function getMiniLMEmbedding(text: string): Promise<number[]> {
   return data.embedding;
 }
 
+// Helper: Keep only filters /search supports, as a string or list of strings;
+// anything else would fail the whole search with a 422
+const filterFields = ["company_id", "product_id", "chunk_type", "category"];
+type Filters = Record<string, string | string[]>;
+function validFilters(filters: unknown): Filters | undefined {
+  if (!filters || typeof filters !== "object" || Array.isArray(filters)) {
+    return undefined;
+  }
+  const valid: Filters = {};
+  for (const [field, value] of Object.entries(filters)) {
+    const ok =
+      typeof value === "string" ||
+      (Array.isArray(value) && value.every((v) => typeof v === "string"));
+    if (filterFields.includes(field) && ok) valid[field] = value;
+  }
+  return Object.keys(valid).length > 0 ? valid : undefined;
+}
+
+// Helper: Embed + search + hydrate in the embedding service (one round trip)
+const rerankTopN = Number(process.env.SEARCH_RERANK_TOP_N ?? 0);
+async function searchLocal(
+  text: string,
+  topK: number,
+  filters?: Filters
+): Promise<Chunk[]> {
+  const baseUrl = process.env.EMBEDDING_SERVICE_URL!;
+  const url = baseUrl.endsWith("/") ? `${baseUrl}search` : `${baseUrl}/search`;
+
+  const resp = await fetch(url, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    // SEARCH_RERANK_TOP_N > 0 re-ranks the topK candidates and keeps that many
+    body: JSON.stringify({
+      query: text,
+      top_k: topK,
+      filters,
+      rerank: rerankTopN > 0,
+      top_n: rerankTopN > 0 ? rerankTopN : undefined,
+      include_payload: true,
+      fields: chunkFields,
+    }),
+  });
+
+  if (!resp.ok) throw new Error(`Search service failed: ${resp.statusText}`);
+  const data = await resp.json();
+  return data.matches
+    .map((m: { payload: Chunk | null }) => m.payload)
+    .filter(Boolean);
+}
+
+// Helper: Fetch chunk payloads by id from the embedding service, in id order
+async function fetchChunks(ids: string[]): Promise<Chunk[]> {
+  if (ids.length === 0) return [];
+  const baseUrl = process.env.EMBEDDING_SERVICE_URL!;
+  const url = baseUrl.endsWith("/")
+    ? `${baseUrl}chunks/fetch`
+    : `${baseUrl}/chunks/fetch`;
+
+  const resp = await fetch(url, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ ids, fields: chunkFields }),
+  });
+
+  if (!resp.ok) throw new Error(`Chunk fetch failed: ${resp.statusText}`);
+  const data = await resp.json();
+  return data.chunks.map((c: { payload: Chunk }) => c.payload);
+}
+
 // Helper: Fetch Chat History
 async function getChatHistory(chatId: string, limitCount = 15) {
   const snapshot = await adminDb
@@ -74,31 +166,26 @@ export async function POST(req: Request) {
       );
     }
 
-    // Generate embedding for query
-    const queryVector = await getMiniLMEmbedding(userQuery);
-
-    // Pinecone search
-    const results = await index.query({
-      vector: queryVector,
-      topK: 30,
-      includeMetadata: false,
-    });
+    // Retrieve chunks: in-process search in the embedding service when
+    // SEARCH_BACKEND=local, otherwise embed the query and search Pinecone,
+    // then hydrate the matched ids from the embedding service
+    let retrieved: Chunk[];
+    if (process.env.SEARCH_BACKEND === "local") {
+      // Optional metadata filters, e.g. { company_id: "jubilee_001", category: "medical" };
+      // the chat UI does not send any yet
+      retrieved = await searchLocal(userQuery, 30, validFilters(body.filters));
+    } else {
+      const queryVector = await getMiniLMEmbedding(userQuery);
+      const results = await index.query({
+        vector: queryVector,
+        topK: 30,
+        includeMetadata: false,
+      });
+      retrieved = await fetchChunks(results.matches.map((m) => m.id));
+    }
 
-    const relevantChunks = results.matches
-      .map((m) => chunkMap.get(m.id))
-      .filter(Boolean);
-
-    // Build retrieved context string
-    const context = relevantChunks
-      .map(
-        (c, i) =>
-          `Result ${i + 1}:\nChunk ID: ${c?.chunk_id}\nMetadata:\n${JSON.stringify(
-            c?.metadata,
-            null,
-            2
-          )}`
-      )
-      .join("\n\n");
+    // Build retrieved context string from every retrieved chunk
+    const context = retrieved.map(renderChunk).join("\n\n");
 
     const history = await getChatHistory(chatId);
 
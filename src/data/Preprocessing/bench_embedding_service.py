@@ -0,0 +1,257 @@
+"""Load-test harness for the embedding service.
+
+Starts ``embedding_service.app`` in-process (uvicorn on a background thread) or
+as a local subprocess, then replays a workload over real HTTP for every
+combination of request mode, concurrency level and text-length mix:
+
+    single  one text per POST /embed
+    batch   --batch-size texts per POST /embed/batch
+
+Texts are drawn from the preprocessed chunk corpus. The length mixes are
+``short``, ``medium`` and ``long`` (the character-length terciles of the corpus)
+and ``mixed`` (the whole corpus). The cache and the persistent store are disabled
+unless --keep-cache is given, so every request reaches the model; so are the
+/search index and the chunk store, whose startup work would compete with the load.
+
+Each scenario reports texts/s, requests/s, p50/p95/p99 latency, errors and the
+server's CPU use (in cores and as a percentage of the available CPUs). A table
+is printed at the end and the same rows are written as JSON with --json.
+
+    python bench_embedding_service.py --modes single batch --concurrency 1 8 32
+    python bench_embedding_service.py --server inprocess --mixes short long --json before.json
+
+Prefer the default subprocess mode for numbers you compare: in-process the load
+generator shares the interpreter (and its GIL) with the server, and CPU use
+includes the client threads.
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MODES = ("single", "batch")
+MIXES = ("short", "medium", "long", "mixed")
+# Caching would turn the benchmark into a lookup test; the /search index and the
+# chunk store are off so servers do not embed or sync the corpus at startup
+NO_CACHE_ENV = {
+    "EMBED_CACHE_MAX_MB": "0",
+    "EMBED_STORE_PATH": "",
+    "EMBED_SEARCH_CHUNK_FILES": "",
+    "EMBED_CHUNK_STORE_PATH": "",
+}
+
+
+def wait_ready(port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/readyz")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"server on port {port} did not start within {timeout}s")
+
+
+def length_mixes(texts: list[str]) -> dict[str, list[str]]:
+    """Split corpus texts into length terciles plus the full mix."""
+    lengths = np.array([len(text) for text in texts])
+    low, high = np.percentile(lengths, [100 / 3, 200 / 3])
+    return {
+        "short": [text for text, n in zip(texts, lengths) if n <= low],
+        "medium": [text for text, n in zip(texts, lengths) if low < n <= high],
+        "long": [text for text, n in zip(texts, lengths) if n > high],
+        "mixed": texts,
+    }
+
+
+class InProcessServer:
+    """uvicorn serving ``embedding_service.app`` on a thread of this process."""
+
+    def __init__(self, port: int):
+        import uvicorn
+
+        import embedding_service
+
+        config = uvicorn.Config(embedding_service.app, port=port, log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+
+    def cpu_seconds(self) -> float:
+        return time.process_time()
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+
+class SubprocessServer:
+    """``uvicorn embedding_service:app`` in a child process."""
+
+    def __init__(self, port: int):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "embedding_service:app",
+             "--port", str(port), "--log-level", "warning", "--no-access-log"],
+            cwd=HERE,
+        )
+
+    def cpu_seconds(self) -> float | None:
+        # utime + stime of the server process, Linux only
+        try:
+            with open(f"/proc/{self.process.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def stop(self) -> None:
+        self.process.send_signal(signal.SIGTERM)
+        self.process.wait(timeout=60)
+
+
+def _post(conn: http.client.HTTPConnection, path: str, payload: dict) -> int:
+    conn.request("POST", path, body=json.dumps(payload), headers={
+        "Content-Type": "application/json",
+        "Accept": "application/octet-stream",
+    })
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def run_scenario(server, port: int, texts: list[str], mode: str, concurrency: int,
+                 batch_size: int, duration: float, seed: int) -> dict:
+    """Drive ``concurrency`` closed-loop clients for ``duration`` seconds."""
+    per_request = 1 if mode == "single" else batch_size
+    latencies: list[float] = []
+    counts = {"requests": 0, "texts": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(client_seed: int) -> None:
+        rng = np.random.default_rng(client_seed)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        while time.monotonic() < deadline:
+            picks = rng.integers(0, len(texts), per_request)
+            if mode == "single":
+                path, payload = "/embed", {"text": texts[picks[0]]}
+            else:
+                path, payload = "/embed/batch", {"texts": [texts[i] for i in picks]}
+            started = time.perf_counter()
+            try:
+                status = _post(conn, path, payload)
+            except OSError:
+                conn.close()
+                status = None
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed_ms)
+                    counts["requests"] += 1
+                    counts["texts"] += per_request
+                else:
+                    counts["errors"] += 1
+
+    cpu_before = server.cpu_seconds()
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(seed + i,)) for i in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    cpu_after = server.cpu_seconds()
+
+    samples = np.array(latencies) if latencies else np.full(1, np.nan)
+    cpu_cores = (cpu_after - cpu_before) / elapsed if cpu_before is not None and cpu_after is not None else None
+    return {
+        "mode": mode,
+        "mix": None,
+        "concurrency": concurrency,
+        "batch_size": per_request,
+        "requests": counts["requests"],
+        "errors": counts["errors"],
+        "texts_per_s": counts["texts"] / elapsed,
+        "requests_per_s": counts["requests"] / elapsed,
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "cpu_cores": cpu_cores,
+        "cpu_percent": cpu_cores / (os.cpu_count() or 1) * 100 if cpu_cores is not None else None,
+    }
+
+
+def print_results(results: list[dict]) -> None:
+    print(f"\n{'mode':<8}{'mix':<8}{'conc':>6}{'batch':>7}{'texts/s':>10}{'req/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'cpu %':>8}")
+    for row in results:
+        cpu = f"{row['cpu_percent']:>8.0f}" if row["cpu_percent"] is not None else f"{'-':>8}"
+        print(f"{row['mode']:<8}{row['mix']:<8}{row['concurrency']:>6}{row['batch_size']:>7}"
+              f"{row['texts_per_s']:>10.1f}{row['requests_per_s']:>9.1f}{row['p50_ms']:>9.1f}"
+              f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['errors']:>8}{cpu}")
+
+
+def bench(args) -> list[dict]:
+    from embedding_backends import load_corpus_texts
+
+    mixes = length_mixes(load_corpus_texts(args.corpus))
+    if not args.keep_cache:
+        os.environ.update(NO_CACHE_ENV)
+    server = InProcessServer(args.port) if args.server == "inprocess" else SubprocessServer(args.port)
+    results = []
+    try:
+        wait_ready(args.port, timeout=300)
+        for mode in args.modes:
+            for mix in args.mixes:
+                for concurrency in args.concurrency:
+                    if args.warmup > 0:
+                        run_scenario(server, args.port, mixes[mix], mode, concurrency,
+                                     args.batch_size, args.warmup, args.seed)
+                    row = run_scenario(server, args.port, mixes[mix], mode, concurrency,
+                                       args.batch_size, args.duration, args.seed)
+                    row["mix"] = mix
+                    results.append(row)
+                    print(json.dumps(row), flush=True)
+    finally:
+        server.stop()
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"server": args.server, "cpus": os.cpu_count(), "results": results}, f, indent=2)
+        print(f"\nWrote {args.json}")
+    return results
+
+
+def main() -> None:
+    from embedding_backends import DEFAULT_CORPUS
+
+    parser = argparse.ArgumentParser(description="Benchmark the embedding service over HTTP")
+    parser.add_argument("--server", choices=("subprocess", "inprocess"), default="subprocess")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--mixes", nargs="+", choices=MIXES, default=["mixed"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--batch-size", type=int, default=32, help="texts per /embed/batch request")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each scenario")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-cache", action="store_true", help="leave the cache and store enabled")
+    parser.add_argument("--json", help="write results to this file")
+    bench(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""CPU inference backends for the embedding service.
+
+Every backend exposes ``encode(texts) -> np.ndarray`` (float32, one row per text),
+``token_lengths(texts)``, ``set_num_threads(n)`` and the tokenizer and maximum
+sequence length of the underlying model, so the service can swap them through the ``EMBED_BACKEND`` setting:
+
+- ``torch-fp32``: the stock SentenceTransformer pipeline
+- ``torch-int8``: the same pipeline with nn.Linear layers dynamically quantised to int8
+- ``onnx``: the transformer exported to ONNX and run on ONNX Runtime, with mean
+  pooling and normalisation done in NumPy
+
+Run this file directly to check parity against fp32 on the chunk corpus or to
+benchmark the backends:
+
+    python embedding_backends.py parity --backends torch-int8 onnx
+    python embedding_backends.py bench --backends torch-fp32 torch-int8 onnx
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+BACKENDS = ("torch-fp32", "torch-int8", "onnx")
+
+# Chunk corpus used for parity checks and benchmarks
+DEFAULT_CORPUS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "preprocessed", "all_companies_preprocessed.json"
+)
+# Exported ONNX graphs are cached here, one file per model and revision
+ONNX_DIR = os.environ.get(
+    "EMBED_ONNX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx")
+)
+
+
+class Backend:
+    """Shared helpers; subclasses set ``tokenizer`` and ``max_seq_length``."""
+
+    tokenizer = None
+    max_seq_length = 512
+
+    def token_lengths(self, texts: list[str]) -> np.ndarray:
+        """Token count of each text after truncation, special tokens included."""
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_seq_length)
+        return np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(texts))
+
+
+class TorchBackend(Backend):
+    """SentenceTransformer on CPU, optionally with dynamic int8 quantisation."""
+
+    def __init__(self, model_name: str, revision: str | None = None, quantize: bool = False):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        self.name = "torch-int8" if quantize else "torch-fp32"
+        self.model = SentenceTransformer(model_name, revision=revision, device="cpu")
+        if quantize:
+            from torch.ao.quantization import quantize_dynamic
+
+            self.model = quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model.eval()
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+    def set_num_threads(self, threads: int) -> None:
+        import torch
+
+        torch.set_num_threads(threads)
+
+
+class OnnxBackend(Backend):
+    """Transformer exported to ONNX and run with ONNX Runtime on CPU."""
+
+    name = "onnx"
+
+    def __init__(self, model_name: str, revision: str | None = None, onnx_path: str | None = None):
+        from sentence_transformers import SentenceTransformer
+
+        st_model = SentenceTransformer(model_name, revision=revision, device="cpu")
+        pooling = st_model[1].get_config_dict()
+        if not (pooling.get("pooling_mode") == "mean" or pooling.get("pooling_mode_mean_tokens")):
+            raise ValueError(f"{model_name} does not use mean pooling, which the ONNX backend assumes")
+        self.normalize = any(type(module).__name__ == "Normalize" for module in st_model)
+        self.tokenizer = st_model.tokenizer
+        self.max_seq_length = st_model.max_seq_length
+
+        if onnx_path is None:
+            safe_name = model_name.replace("/", "__")
+            onnx_path = os.path.join(ONNX_DIR, f"{safe_name}-{revision or 'main'}.onnx")
+        if not os.path.exists(onnx_path):
+            export_onnx(st_model[0].auto_model, self.tokenizer, onnx_path)
+        del st_model
+
+        self.onnx_path = onnx_path
+        self.set_num_threads(int(os.environ.get("EMBED_ONNX_THREADS", "0")))
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    def set_num_threads(self, threads: int) -> None:
+        """(Re)create the session; ONNX Runtime thread pools are fixed per session."""
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(self.onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np",
+        )
+        feeds = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        (hidden,) = self.session.run(["last_hidden_state"], feeds)
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings.astype(np.float32)
+
+
+def export_onnx(transformer, tokenizer, path: str) -> None:
+    """Export a Hugging Face encoder to ONNX with dynamic batch and sequence axes."""
+    import torch
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    class Encoder(torch.nn.Module):
+        # Keyword call keeps the export independent of forward()'s positional order
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            outputs = self.transformer(**dict(zip(input_names, inputs)), return_dict=True)
+            return outputs.last_hidden_state
+
+    encoder = Encoder().eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder,
+            tuple(sample[name] for name in input_names),
+            path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+
+
+def load_backend(name: str, model_name: str, revision: str | None = None):
+    """Build the backend selected by name."""
+    if name == "torch-fp32":
+        return TorchBackend(model_name, revision)
+    if name == "torch-int8":
+        return TorchBackend(model_name, revision, quantize=True)
+    if name == "onnx":
+        return OnnxBackend(model_name, revision)
+    raise ValueError(f"Unknown backend {name!r}, expected one of {', '.join(BACKENDS)}")
+
+
+def load_corpus_texts(path: str = DEFAULT_CORPUS, limit: int | None = None) -> list[str]:
+    """Load chunk texts from a preprocessed corpus file."""
+    with open(path, "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+    texts = [chunk["text"] for chunk in chunks if chunk.get("text")]
+    return texts[:limit] if limit else texts
+
+
+def encode_all(backend, texts: list[str], batch_size: int) -> np.ndarray:
+    return np.vstack([backend.encode(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+
+
+def parity_report(backend_names: list[str], model_name: str, revision: str | None,
+                  texts: list[str], batch_size: int) -> dict:
+    """Cosine deviation of each backend from the torch fp32 reference."""
+    reference = encode_all(load_backend("torch-fp32", model_name, revision), texts, batch_size)
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+    report = {}
+    for name in backend_names:
+        vectors = encode_all(load_backend(name, model_name, revision), texts, batch_size)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        cosine = np.einsum("ij,ij->i", reference, vectors)
+        deviation = 1.0 - cosine
+        report[name] = {
+            "texts": len(texts),
+            "mean_cosine": float(cosine.mean()),
+            "min_cosine": float(cosine.min()),
+            "mean_deviation": float(deviation.mean()),
+            "p99_deviation": float(np.percentile(deviation, 99)),
+            "max_deviation": float(deviation.max()),
+        }
+    return report
+
+
+def bench_report(backend_names: list[str], model_name: str, revision: str | None,
+                 texts: list[str], batch_size: int, single_runs: int) -> dict:
+    """Single-text latency and batched throughput per backend."""
+    report = {}
+    for name in backend_names:
+        load_started = time.perf_counter()
+        backend = load_backend(name, model_name, revision)
+        load_s = time.perf_counter() - load_started
+        backend.encode(texts[:batch_size])  # warm-up
+
+        latencies = []
+        for i in range(single_runs):
+            started = time.perf_counter()
+            backend.encode([texts[i % len(texts)]])
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        encode_all(backend, texts, batch_size)
+        elapsed = time.perf_counter() - started
+        report[name] = {
+            "load_s": load_s,
+            "single_p50_ms": float(np.percentile(latencies, 50)),
+            "single_p95_ms": float(np.percentile(latencies, 95)),
+            "single_p99_ms": float(np.percentile(latencies, 99)),
+            "batch_size": batch_size,
+            "throughput_texts_per_s": len(texts) / elapsed,
+        }
+    return report
+
+
+def print_table(report: dict) -> None:
+    columns = list(next(iter(report.values())).keys())
+    print(f"{'backend':<12}" + "".join(f"{column:>24}" for column in columns))
+    for name, row in report.items():
+        cells = "".join(
+            f"{value:>24.6f}" if isinstance(value, float) else f"{value:>24}" for value in row.values()
+        )
+        print(f"{name:<12}{cells}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare embedding inference backends")
+    parser.add_argument("command", choices=["parity", "bench"])
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--model", default=os.environ.get("EMBED_MODEL_NAME", "all-MiniLM-L6-v2"))
+    parser.add_argument("--revision", default=os.environ.get("EMBED_MODEL_REVISION") or None)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N chunks")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--single-runs", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    texts = load_corpus_texts(args.corpus, args.limit)
+    if args.command == "parity":
+        report = parity_report(args.backends, args.model, args.revision, texts, args.batch_size)
+    else:
+        report = bench_report(args.backends, args.model, args.revision, texts,
+                              args.batch_size, args.single_runs)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_table(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+from embedding_executor import InferenceExecutor, Overloaded
+
+
+def length_sorted_batches(lengths: np.ndarray, batch_size: int) -> list[np.ndarray]:
+    """Split row indices into batches of similar token length.
+
+    Rows are stably sorted by length before slicing, so each batch pads to a
+    length close to its own texts instead of the longest text in the request.
+    Callers scatter results back with ``out[rows] = vectors``.
+    """
+    order = np.argsort(lengths, kind="stable")
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+class PaddingStats:
+    """Running totals of real vs padded tokens across encoded batches."""
+
+    def __init__(self):
+        self.batches = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, lengths: np.ndarray) -> None:
+        """Record one batch; every sequence pads to the batch maximum."""
+        if len(lengths) == 0:
+            return
+        with self._lock:
+            self.batches += 1
+            self.real_tokens += int(lengths.sum())
+            self.padded_tokens += int(lengths.max()) * len(lengths)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "real_tokens": self.real_tokens,
+            "padded_tokens": self.padded_tokens,
+            "padding_efficiency": self.real_tokens / self.padded_tokens if self.padded_tokens else 1.0,
+        }
+
+
+class MicroBatcher:
+    """Collect concurrent single-text requests and encode them as one batch.
+
+    Requests are queued and a background task drains the queue, waiting at most
+    ``max_wait_ms`` after the first request of a batch or until ``max_batch_size``
+    requests are collected, then encodes them in one forward pass on ``executor``.
+    At most ``max_pending`` requests may wait; beyond that ``submit`` raises
+    ``Overloaded``.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[list[str]], np.ndarray],
+        executor: InferenceExecutor,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        max_pending: int = 1024,
+        on_wait: Callable[[float], None] | None = None,
+    ):
+        self.encode_fn = encode_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+        # Optional observer for the time a request waited for its batch, in seconds
+        self.on_wait = on_wait
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, text: str) -> np.ndarray:
+        """Queue one text and wait for its embedding."""
+        if self._queue is None:
+            raise RuntimeError("MicroBatcher has not been started")
+        if self._queue.qsize() >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded(self.executor.retry_after())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> list[tuple[str, asyncio.Future, float]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued before waiting on the window
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            # Callers that disconnected while queued have cancelled futures
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+            if self.on_wait is not None:
+                dispatched = time.perf_counter()
+                for _, _, queued_at in batch:
+                    self.on_wait(dispatched - queued_at)
+            texts = [text for text, _, _ in batch]
+            try:
+                vectors = await self.executor.run(self.encode_fn, texts)
+            except Exception as exc:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future, _), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "rejected": self.rejected,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
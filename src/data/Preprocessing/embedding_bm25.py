@@ -0,0 +1,87 @@
+import re
+
+import numpy as np
+from scipy import sparse
+
+from embedding_cache import normalize_text
+from embedding_search import top_k
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split normalised text into word tokens; "IRA/19/007/2025" -> ira, 19, 007, 2025."""
+    return _TOKEN.findall(normalize_text(text))
+
+
+class Bm25Index:
+    """Okapi BM25 over chunk texts, stored as a precomputed term x chunk weight matrix.
+
+    Every non-zero is the full BM25 term weight
+    ``idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len / avg_len))``, so scoring a
+    query is one sparse product of its term counts with the rows of the query
+    terms; postings of other terms are never touched.
+    """
+
+    def __init__(self, ids: list[str], texts: list[str], k1: float = 1.2, b: float = 0.75):
+        self.ids = list(ids)
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: dict[str, int] = {}
+        term_rows, doc_cols, counts = [], [], []
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[doc] = len(tokens)
+            # int64 even for a text without tokens, or concatenate upcasts to float64
+            terms, tf = np.unique(
+                np.array([self.vocabulary.setdefault(token, len(self.vocabulary)) for token in tokens],
+                         dtype=np.int64),
+                return_counts=True,
+            )
+            term_rows.append(terms)
+            doc_cols.append(np.full(len(terms), doc))
+            counts.append(tf)
+        term_rows = np.concatenate(term_rows) if texts else np.empty(0, dtype=np.int64)
+        doc_cols = np.concatenate(doc_cols) if texts else np.empty(0, dtype=np.int64)
+        tf = np.concatenate(counts).astype(np.float32) if texts else np.empty(0, dtype=np.float32)
+
+        doc_freq = np.bincount(term_rows, minlength=len(self.vocabulary))
+        idf = np.log1p((len(texts) - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths / max(lengths.mean() if len(texts) else 0.0, 1.0))
+        weights = idf[term_rows] * tf * (k1 + 1) / (tf + norm[doc_cols])
+        self.weights = sparse.csr_matrix(
+            (weights, (term_rows, doc_cols)), shape=(len(self.vocabulary), len(texts)), dtype=np.float32,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def query_vector(self, query: str) -> sparse.csr_matrix:
+        terms = np.array([self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary],
+                         dtype=np.int64)
+        terms, counts = np.unique(terms, return_counts=True)
+        return sparse.csr_matrix(
+            (counts.astype(np.float32), (np.zeros(len(terms), dtype=np.int64), terms)),
+            shape=(1, len(self.vocabulary)),
+        )
+
+    def search(self, query: str, k: int, rows: np.ndarray | None = None) -> tuple[list[str], np.ndarray]:
+        """Return the ids and BM25 scores of the ``k`` best chunks with a non-zero score.
+
+        With ``rows`` only those chunks can be returned; the product already
+        touches only the query terms' postings, so the filter is applied to its
+        result.
+        """
+        scores = (self.query_vector(query) @ self.weights).toarray().ravel()
+        candidates = np.flatnonzero(scores) if rows is None else rows[scores[rows] > 0]
+        best = candidates[top_k(scores[candidates], k)]
+        return [self.ids[row] for row in best], scores[best]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.ids),
+            "vocabulary": len(self.vocabulary),
+            "postings": int(self.weights.nnz),
+            "bytes": int(self.weights.data.nbytes + self.weights.indices.nbytes + self.weights.indptr.nbytes),
+        }
@@ -0,0 +1,98 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Rough per-entry bookkeeping cost (key string, OrderedDict node, tuple, array header)
+ENTRY_OVERHEAD_BYTES = 240
+
+
+def normalize_text(text: str) -> str:
+    """Apply Unicode NFKC, collapse whitespace and casefold."""
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def text_key(text: str) -> str:
+    """Return the SHA-256 hex digest of the normalised text."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Thread-safe LRU cache of embeddings bounded by memory and optional TTL."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float | None = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds or None
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: OrderedDict[str, tuple[np.ndarray, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            vector, stored_at = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        size = vector.nbytes + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        # Cached arrays are shared between callers, so freeze a private copy
+        vector = np.array(vector, dtype=np.float32, copy=True)
+        vector.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (vector, time.monotonic())
+            self.bytes_used += size
+            while self.bytes_used > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+
+    def _remove(self, key: str) -> None:
+        vector, _ = self._entries.pop(key)
+        self.bytes_used -= vector.nbytes + ENTRY_OVERHEAD_BYTES
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import zlib
+
+from embedding_sqlite import SELECT_CHUNK, SqliteConnections
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_id TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    payload BLOB NOT NULL
+) WITHOUT ROWID
+"""
+
+
+def _encode(payload: dict) -> tuple[str, bytes]:
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode()
+    return hashlib.sha1(raw).hexdigest(), zlib.compress(raw, 6)
+
+
+def project(payload: dict, fields: list[str] | None) -> dict:
+    """Keep only the given fields; "metadata.product_name" selects a nested key."""
+    if fields is None:
+        return payload
+    projected = {}
+    for field in fields:
+        value, path = payload, field.split(".")
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = projected
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+    return projected
+
+
+class ChunkStore:
+    """Chunk payloads by chunk id on SQLite, zlib-compressed JSON, one row per chunk.
+
+    ``sync`` mirrors the chunk files into the store, rewriting only rows whose
+    content changed, so the service can hydrate matches by primary-key lookups
+    instead of every client keeping its own copy of the corpus.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.reads = 0
+        self.hits = 0
+        self._connections = SqliteConnections(path)
+        self._connections.get().execute(_SCHEMA)
+
+    def sync(self, payloads: dict[str, dict]) -> dict:
+        """Make the store hold exactly ``payloads``; return how many rows were written and deleted."""
+        conn = self._connections.get()
+        stored = dict(conn.execute("SELECT chunk_id, digest FROM chunks"))
+        rows = []
+        for chunk_id, payload in payloads.items():
+            digest, blob = _encode(payload)
+            if stored.get(chunk_id) != digest:
+                rows.append((chunk_id, digest, blob))
+        stale = [(chunk_id,) for chunk_id in stored if chunk_id not in payloads]
+        with self._connections.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO chunks (chunk_id, digest, payload) VALUES (?, ?, ?)", rows)
+            conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", stale)
+        return {"written": len(rows), "deleted": len(stale)}
+
+    def get_many(self, chunk_ids: list[str], fields: list[str] | None = None) -> dict[str, dict]:
+        """Return the payloads of whichever chunk ids are stored, projected to ``fields``."""
+        conn = self._connections.get()
+        found = {}
+        for start in range(0, len(chunk_ids), SELECT_CHUNK):
+            chunk = chunk_ids[start:start + SELECT_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT chunk_id, payload FROM chunks WHERE chunk_id IN ({placeholders})", chunk)
+            for chunk_id, blob in rows:
+                found[chunk_id] = project(json.loads(zlib.decompress(blob)), fields)
+        self.reads += len(chunk_ids)
+        self.hits += len(found)
+        return found
+
+    def stats(self) -> dict:
+        count, size = self._connections.get().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM chunks"
+        ).fetchone()
+        return {
+            "path": self.path,
+            "chunks": count,
+            "payload_bytes": size,
+            "reads": self.reads,
+            "hits": self.hits,
+        }
@@ -0,0 +1,90 @@
+import base64
+import json
+
+import numpy as np
+from fastapi import Response
+
+OCTET_STREAM = "application/octet-stream"
+JSON = "application/json"
+
+# Little-endian wire dtypes
+DTYPES = {"float32": "<f4", "float16": "<f2"}
+
+
+def parse_accept(header: str | None) -> list[tuple[str, dict[str, str]]]:
+    """Split an Accept header into (media type, params), highest q first."""
+    ranges = []
+    for position, part in enumerate((header or "").split(",")):
+        fields = [field.strip() for field in part.split(";")]
+        if not fields[0]:
+            continue
+        params = {}
+        for field in fields[1:]:
+            name, _, value = field.partition("=")
+            params[name.strip().lower()] = value.strip().strip('"').lower()
+        try:
+            quality = float(params.pop("q", "1"))
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, position, fields[0].lower(), params))
+    ranges.sort()
+    return [(media_type, params) for _, _, media_type, params in ranges]
+
+
+def negotiate(accept: str | None) -> tuple[str, str]:
+    """Pick the response encoding for an Accept header.
+
+    Returns ``("binary", dtype)`` for ``application/octet-stream`` (raw little-endian
+    vectors, ``dtype`` param defaults to float32), ``("base64", dtype)`` for
+    ``application/json; encoding=base64`` (packed vectors inside JSON, defaults to
+    float16) and ``("json", "float32")`` for everything else.
+    """
+    for media_type, params in parse_accept(accept):
+        if media_type == OCTET_STREAM:
+            return "binary", _dtype(params, "float32")
+        if media_type == JSON and params.get("encoding") == "base64":
+            return "base64", _dtype(params, "float16")
+        if media_type in (JSON, "application/*", "*/*"):
+            return "json", "float32"
+    return "json", "float32"
+
+
+def _dtype(params: dict[str, str], default: str) -> str:
+    dtype = params.get("dtype", default)
+    return dtype if dtype in DTYPES else default
+
+
+def pack_vectors(vectors: np.ndarray, dtype: str) -> bytes:
+    return np.ascontiguousarray(vectors, dtype=DTYPES[dtype]).tobytes()
+
+
+def vectors_response(vectors: np.ndarray, accept: str | None, extra: dict | None = None) -> Response | None:
+    """Encode vectors as binary or base64 JSON, or return None for the plain JSON path.
+
+    ``vectors`` is a single vector or a 2-D array in request order. Binary bodies
+    carry their shape and dtype in ``X-Embedding-*`` headers; ``extra`` fields are
+    added to the base64 JSON body. Neither path goes through pydantic.
+    """
+    encoding, dtype = negotiate(accept)
+    if encoding == "json":
+        return None
+    headers = {
+        "Vary": "Accept",
+        "X-Embedding-Dtype": dtype,
+        "X-Embedding-Shape": ",".join(str(size) for size in vectors.shape),
+    }
+    if encoding == "binary":
+        return Response(pack_vectors(vectors, dtype), media_type=OCTET_STREAM, headers=headers)
+    body = {
+        **(extra or {}),
+        "dtype": dtype,
+        "shape": list(vectors.shape),
+        "data": base64.b64encode(pack_vectors(vectors, dtype)).decode("ascii"),
+    }
+    return Response(json.dumps(body), media_type=JSON, headers=headers)
+
+
+def unpack_vectors(data: bytes, dtype: str, shape: tuple[int, ...]) -> np.ndarray:
+    """Inverse of pack_vectors for clients; returns float32."""
+    return np.frombuffer(data, dtype=DTYPES[dtype]).reshape(shape).astype(np.float32)
@@ -0,0 +1,120 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import numpy as np
+
+
+class Overloaded(Exception):
+    """Raised when the inference queue is full; callers should retry later."""
+
+    def __init__(self, retry_after: int, reason: str = "inference queue is full"):
+        super().__init__(f"{reason}, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """Fixed-concurrency executor for model calls with a bounded wait queue.
+
+    At most ``concurrency`` jobs run at once and at most ``max_queue`` more may
+    wait; anything beyond that is rejected immediately with ``Overloaded`` so the
+    latency of admitted jobs stays bounded by the queue length. The suggested
+    Retry-After is the time the current queue needs to drain at the observed
+    mean service time.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 1,
+        max_queue: int = 64,
+        sample_size: int = 1024,
+        on_wait: Callable[[float], None] | None = None,
+        on_service: Callable[[float], None] | None = None,
+    ):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        # Optional observers for queue wait and service time, in seconds
+        self.on_wait = on_wait
+        self.on_service = on_service
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self._pending = 0
+        self._running = 0
+        self._service_s = 0.0
+        self._waits_ms: deque[float] = deque(maxlen=sample_size)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="inference")
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending - self._running
+
+    def retry_after(self) -> int:
+        mean_service_s = self._service_s / self.completed if self.completed else 1.0
+        return max(1, math.ceil(mean_service_s * (self.queue_depth + 1) / self.concurrency))
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run ``fn(*args)`` on an inference thread, or raise Overloaded."""
+        with self._lock:
+            if self._pending >= self.concurrency + self.max_queue:
+                self.rejected += 1
+                raise Overloaded(self.retry_after())
+            self._pending += 1
+            self.submitted += 1
+        queued_at = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            with self._lock:
+                self._running += 1
+                self._waits_ms.append((started - queued_at) * 1000)
+            if self.on_wait is not None:
+                self.on_wait(started - queued_at)
+            try:
+                return fn(*args)
+            finally:
+                service_s = time.perf_counter() - started
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+                    self.completed += 1
+                    self._service_s += service_s
+                if self.on_service is not None:
+                    self.on_service(service_s)
+
+        try:
+            future = self._pool.submit(job)
+        except BaseException:
+            self._release()
+            raise
+        # A job cancelled before it started (caller went away) never runs its finally
+        future.add_done_callback(lambda done: self._release() if done.cancelled() else None)
+        return await asyncio.wrap_future(future)
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = np.array(self._waits_ms) if self._waits_ms else np.zeros(1)
+            return {
+                "concurrency": self.concurrency,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queue_depth": self.queue_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_p50_ms": float(np.percentile(waits, 50)),
+                "wait_p99_ms": float(np.percentile(waits, 99)),
+                "mean_service_ms": self._service_s / self.completed * 1000 if self.completed else 0.0,
+            }
@@ -0,0 +1,62 @@
+import numpy as np
+
+# Chunk metadata fields /search can filter on
+FILTER_FIELDS = ("company_id", "chunk_type", "product_id", "category")
+
+
+def filter_values(field: str, value) -> set[str]:
+    """Normalised values a chunk is indexed under for one field.
+
+    Categories are hierarchical ("general / personal insurance / motor"), so
+    besides the full path every segment is indexed and ``category=motor`` matches.
+    """
+    if value is None or value == "":
+        return set()
+    value = str(value).strip().casefold()
+    if field == "category":
+        return {value, *(part.strip() for part in value.split("/") if part.strip())}
+    return {value}
+
+
+class MetadataBitmaps:
+    """Packed bitsets of index rows, one per (field, value), built once per index.
+
+    A filter ORs the bitsets of the values given for a field and ANDs across
+    fields, then yields the matching row numbers so only those rows are scored.
+    """
+
+    def __init__(self, chunks: list[dict]):
+        self.size = len(chunks)
+        masks: dict[tuple[str, str], np.ndarray] = {}
+        for row, chunk in enumerate(chunks):
+            for field in FILTER_FIELDS:
+                for value in filter_values(field, chunk.get(field)):
+                    mask = masks.get((field, value))
+                    if mask is None:
+                        mask = masks[(field, value)] = np.zeros(self.size, dtype=bool)
+                    mask[row] = True
+        self._bitsets = {key: np.packbits(mask) for key, mask in masks.items()}
+        self._empty = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def rows(self, filters: dict[str, list[str]] | None) -> np.ndarray | None:
+        """Sorted row numbers matching every field's filter, or None when unfiltered."""
+        if not filters:
+            return None
+        matched = None
+        for field, values in filters.items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"cannot filter on {field!r}; use one of {', '.join(FILTER_FIELDS)}")
+            union = self._empty.copy()
+            for value in values:
+                for key in filter_values(field, value):
+                    bits = self._bitsets.get((field, key))
+                    if bits is not None:
+                        union |= bits
+            matched = union if matched is None else matched & union
+        return np.flatnonzero(np.unpackbits(matched, count=self.size))
+
+    def stats(self) -> dict:
+        return {
+            "bitsets": len(self._bitsets),
+            "bytes": sum(bits.nbytes for bits in self._bitsets.values()),
+        }
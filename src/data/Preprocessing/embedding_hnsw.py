@@ -0,0 +1,367 @@
+"""HNSW approximate nearest-neighbour index over unit-length embeddings.
+
+A pure NumPy implementation of Hierarchical Navigable Small World graphs
+(Malkov & Yashunin). Each node is assigned a random top layer; every layer is a
+proximity graph whose links are chosen with the neighbour-selection heuristic,
+so a greedy beam search from the top layer's entry point reaches the query's
+neighbourhood in a logarithmic number of hops. Distances are ``1 - cosine``.
+
+Build parameters are ``m`` (links per node, 2*m on layer 0) and
+``ef_construction`` (beam width while inserting); ``ef_search`` is the beam
+width at query time and trades latency for recall. Indexes save to a single
+``.npz`` file and load back without rebuilding.
+
+    python embedding_hnsw.py report --ef-search 16 32 64 128
+    python embedding_hnsw.py report --synthetic 100000 --m 16 --ef-construction 100 --json hnsw.json
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from embedding_search import ExactIndex, corpus_vectors, normalize_rows, synthetic_vectors, top_k
+
+
+class HnswIndex:
+    # Filtered searches over at most this many rows skip the graph and score them exactly
+    filter_exact_max = 20000
+
+    def __init__(self, dim: int, m: int = 16, ef_construction: int = 200, ef_search: int = 64, seed: int = 0):
+        if m < 2:
+            raise ValueError("m must be at least 2")
+        self.dim = dim
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = max(ef_construction, m)
+        self.ef_search = ef_search
+        self.seed = seed
+        self.ids: list[str] = []
+        self.levels: list[int] = []
+        # graph[layer][node] -> neighbour rows
+        self.graph: list[dict[int, list[int]]] = []
+        self.entry = -1
+        self.max_level = -1
+        # Caller-defined digest of what the vectors were built from, saved with the graph
+        self.source = ""
+        self._ml = 1 / math.log(m)
+        self._rng = np.random.default_rng(seed)
+        self._data = np.empty((0, dim), dtype=np.float32)
+        self._rows_by_id: dict[str, int] | None = None
+
+    @classmethod
+    def build(cls, ids: list[str], vectors: np.ndarray, **params) -> "HnswIndex":
+        index = cls(vectors.shape[1], **params)
+        index.add(ids, vectors)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._data[:len(self.ids)]
+
+    def add(self, ids: list[str], vectors: np.ndarray) -> None:
+        """Insert vectors one at a time; rows are normalised first."""
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors must have the same length")
+        vectors = normalize_rows(vectors)
+        start = len(self.ids)
+        if start + len(ids) > len(self._data):
+            capacity = max(start + len(ids), 2 * len(self._data))
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown[:start] = self._data[:start]
+            self._data = grown
+        self._data[start:start + len(ids)] = vectors
+        for offset, chunk_id in enumerate(ids):
+            self.ids.append(chunk_id)
+            self._insert(start + offset)
+
+    def _insert(self, node: int) -> None:
+        query = self._data[node]
+        level = int(-math.log(1.0 - self._rng.random()) * self._ml)
+        self.levels.append(level)
+        while len(self.graph) <= level:
+            self.graph.append({})
+        if self.entry < 0:
+            for layer in range(level + 1):
+                self.graph[layer][node] = []
+            self.entry, self.max_level = node, level
+            return
+
+        entry_points = [self.entry]
+        for layer in range(self.max_level, level, -1):
+            _, nodes = self._search_layer(query, entry_points, 1, layer)
+            entry_points = nodes[:1]
+        for layer in range(min(level, self.max_level), -1, -1):
+            dists, nodes = self._search_layer(query, entry_points, self.ef_construction, layer)
+            max_links = self.m0 if layer == 0 else self.m
+            neighbours = self._select(dists, nodes, self.m)
+            self.graph[layer][node] = neighbours
+            for neighbour in neighbours:
+                links = self.graph[layer][neighbour]
+                links.append(node)
+                if len(links) > max_links:
+                    # Re-select the over-full neighbour's links with the same heuristic
+                    rows = np.array(links)
+                    self.graph[layer][neighbour] = self._select(
+                        1.0 - self._data[rows] @ self._data[neighbour], links, max_links,
+                    )
+            entry_points = nodes
+        for layer in range(self.max_level + 1, level + 1):
+            self.graph[layer][node] = []
+        if level > self.max_level:
+            self.entry, self.max_level = node, level
+
+    def _select(self, dists, nodes: list[int], m: int) -> list[int]:
+        """Neighbour-selection heuristic, topped up with the nearest pruned candidates.
+
+        A candidate is kept only if it is closer to the base node than to every
+        neighbour kept so far, which spreads links across directions instead of
+        spending them all inside one dense cluster.
+        """
+        dists = np.asarray(dists)
+        if len(nodes) <= m:
+            return list(nodes)
+        order = np.argsort(dists, kind="stable")
+        candidates = np.asarray(nodes)[order]
+        candidate_dists = dists[order]
+        vectors = self._data[candidates]
+        kept: list[int] = []
+        pruned: list[int] = []
+        for i in range(len(candidates)):
+            if len(kept) >= m:
+                break
+            if not kept or (1.0 - vectors[kept] @ vectors[i]).min() > candidate_dists[i]:
+                kept.append(i)
+            else:
+                pruned.append(i)
+        kept.extend(pruned[:m - len(kept)])
+        return [int(candidates[i]) for i in kept]
+
+    def _search_layer(self, query: np.ndarray, entry_points: list[int], ef: int,
+                      layer: int, allowed: np.ndarray | None = None) -> tuple[list[float], list[int]]:
+        """Beam search on one layer; returns the ``ef`` closest nodes found, nearest first.
+
+        With an ``allowed`` mask the walk still crosses disallowed nodes, but
+        only allowed nodes enter the results.
+        """
+        data = self._data
+        links = self.graph[layer]
+        visited = set(entry_points)
+        entry_dists = (1.0 - data[entry_points] @ query).tolist()
+        candidates = list(zip(entry_dists, entry_points))
+        heapq.heapify(candidates)
+        # Max-heap of the best results so far, by negated distance
+        results = [(-dist, node) for dist, node in candidates if allowed is None or allowed[node]]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        while candidates:
+            dist, node = heapq.heappop(candidates)
+            if len(results) >= ef and dist > -results[0][0]:
+                break
+            fresh = [neighbour for neighbour in links[node] if neighbour not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            bound = -results[0][0] if results else math.inf
+            for neighbour_dist, neighbour in zip((1.0 - data[fresh] @ query).tolist(), fresh):
+                if len(results) < ef or neighbour_dist < bound:
+                    heapq.heappush(candidates, (neighbour_dist, neighbour))
+                    if allowed is not None and not allowed[neighbour]:
+                        continue
+                    heapq.heappush(results, (-neighbour_dist, neighbour))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+                    bound = -results[0][0]
+        ordered = sorted((-negated, node) for negated, node in results)
+        return [dist for dist, _ in ordered], [node for _, node in ordered]
+
+    def search(self, query: np.ndarray, k: int, rows: np.ndarray | None = None,
+               ef: int | None = None) -> tuple[list[str], np.ndarray]:
+        """Return the ids and cosine scores of the (approximately) ``k`` nearest chunks.
+
+        With ``rows`` only those rows can be returned. Small row sets are scored
+        exactly, which is both faster and exact; larger ones walk the graph with
+        the beam widened by the inverse of the filter's selectivity.
+        """
+        if self.entry < 0 or (rows is not None and len(rows) == 0):
+            return [], np.empty(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        ef = max(ef or self.ef_search, k)
+        allowed = None
+        if rows is not None:
+            if len(rows) <= self.filter_exact_max:
+                scores = self._data[rows] @ query
+                best = top_k(scores, k)
+                return [self.ids[row] for row in rows[best]], scores[best]
+            allowed = np.zeros(len(self.ids), dtype=bool)
+            allowed[rows] = True
+            ef = min(int(ef * len(self.ids) / len(rows)), len(self.ids))
+        entry_points = [self.entry]
+        for layer in range(self.max_level, 0, -1):
+            _, entry_points = self._search_layer(query, entry_points, 1, layer)
+        dists, nodes = self._search_layer(query, entry_points, ef, 0, allowed)
+        return [self.ids[node] for node in nodes[:k]], 1.0 - np.array(dists[:k], dtype=np.float32)
+
+    def vectors_for(self, ids: list[str]) -> np.ndarray:
+        """Unit vectors of the given chunk ids, in order."""
+        if self._rows_by_id is None or len(self._rows_by_id) != len(self.ids):
+            self._rows_by_id = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        return self._data[[self._rows_by_id[chunk_id] for chunk_id in ids]]
+
+    def save(self, path: str) -> None:
+        """Write vectors, ids and the graph (one CSR block per layer) to ``path`` (.npz)."""
+        arrays = {
+            "vectors": self.vectors,
+            "ids": np.array(self.ids, dtype=str),
+            "levels": np.array(self.levels, dtype=np.int32),
+            "params": np.array(json.dumps({
+                "m": self.m, "ef_construction": self.ef_construction, "ef_search": self.ef_search,
+                "seed": self.seed, "entry": self.entry, "max_level": self.max_level, "source": self.source,
+            })),
+        }
+        for layer, links in enumerate(self.graph):
+            nodes = np.array(sorted(links), dtype=np.int32)
+            counts = [len(links[node]) for node in nodes]
+            arrays[f"layer{layer}_nodes"] = nodes
+            arrays[f"layer{layer}_offsets"] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            arrays[f"layer{layer}_links"] = np.array(
+                [neighbour for node in nodes for neighbour in links[node]], dtype=np.int32,
+            )
+        # Several workers may save the same path while others load it: write a
+        # private temporary file and rename it into place
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "HnswIndex":
+        with np.load(path, allow_pickle=False) as arrays:
+            params = json.loads(str(arrays["params"]))
+            vectors = arrays["vectors"]
+            index = cls(vectors.shape[1], params["m"], params["ef_construction"], params["ef_search"], params["seed"])
+            index._data = np.ascontiguousarray(vectors, dtype=np.float32)
+            index.ids = arrays["ids"].tolist()
+            index.levels = arrays["levels"].tolist()
+            index.entry, index.max_level = params["entry"], params["max_level"]
+            index.source = params.get("source", "")
+            for layer in range(index.max_level + 1):
+                nodes = arrays[f"layer{layer}_nodes"].tolist()
+                offsets = arrays[f"layer{layer}_offsets"]
+                links = arrays[f"layer{layer}_links"]
+                index.graph.append({
+                    node: links[offsets[i]:offsets[i + 1]].tolist() for i, node in enumerate(nodes)
+                })
+        return index
+
+    def stats(self) -> dict:
+        link_count = sum(len(neighbours) for layer in self.graph for neighbours in layer.values())
+        return {
+            "kind": "hnsw",
+            "size": len(self.ids),
+            "dim": self.dim,
+            "m": self.m,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "layers": self.max_level + 1,
+            "bytes": int(self.vectors.nbytes) + link_count * 4,
+        }
+
+
+def recall_report(ids: list[str], vectors: np.ndarray, queries: np.ndarray, k: int, m: int,
+                  ef_construction: int, ef_search_values: list[int], save_path: str | None = None) -> dict:
+    """Recall@k and per-query latency of HNSW at each ef_search, against exact search."""
+    exact = ExactIndex(ids, vectors)
+    exact_ms = []
+    truth = []
+    for query in queries:
+        started = time.perf_counter()
+        found, _ = exact.search(query, k)
+        exact_ms.append((time.perf_counter() - started) * 1000)
+        truth.append(set(found))
+
+    started = time.perf_counter()
+    index = HnswIndex.build(ids, vectors, m=m, ef_construction=ef_construction)
+    build_s = time.perf_counter() - started
+    if save_path:
+        index.save(save_path)
+        started = time.perf_counter()
+        index = HnswIndex.load(save_path)
+        load_s = time.perf_counter() - started
+    else:
+        load_s = None
+
+    rows = {}
+    for ef in ef_search_values:
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            found, _ = index.search(query, k, ef=ef)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(expected.intersection(found))
+        rows[f"ef={ef}"] = {
+            f"recall@{k}": hits / (k * len(queries)),
+            "mean_ms": float(np.mean(latencies)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+        }
+    rows["exact"] = {
+        f"recall@{k}": 1.0,
+        "mean_ms": float(np.mean(exact_ms)),
+        "p99_ms": float(np.percentile(exact_ms, 99)),
+    }
+    return {"index": index.stats(), "build_s": build_s, "load_s": load_s, "results": rows}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="HNSW index recall/latency report")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_parser = sub.add_parser("report")
+    report_parser.add_argument("--m", type=int, default=16)
+    report_parser.add_argument("--ef-construction", type=int, default=200)
+    report_parser.add_argument("--ef-search", nargs="+", type=int, default=[16, 32, 64, 128, 256])
+    report_parser.add_argument("--k", type=int, default=10)
+    report_parser.add_argument("--queries", type=int, default=200)
+    report_parser.add_argument("--synthetic", type=int, default=0,
+                               help="index this many synthetic vectors instead of the chunk corpus")
+    report_parser.add_argument("--model", default=os.environ.get("EMBED_MODEL_NAME", "all-MiniLM-L6-v2"))
+    report_parser.add_argument("--backend", default="torch-fp32")
+    report_parser.add_argument("--save", help="save the index here and measure a reload")
+    report_parser.add_argument("--json", help="write the report to this file")
+    report_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic + args.queries, 384, clusters=max(8, args.synthetic // 500),
+                                    seed=args.seed)
+        queries, vectors = vectors[:args.queries], vectors[args.queries:]
+        ids = [str(i) for i in range(len(vectors))]
+    else:
+        ids, vectors = corpus_vectors(args.model, args.backend)
+        # Perturbed chunks stand in for queries so no query is its own exact match
+        picks = rng.integers(0, len(vectors), args.queries)
+        queries = normalize_rows(vectors[picks] + 0.05 * rng.standard_normal((args.queries, vectors.shape[1])))
+    report = recall_report(ids, vectors, queries, args.k, args.m, args.ef_construction, args.ef_search, args.save)
+
+    print(f"{len(ids)} vectors, m={args.m}, ef_construction={args.ef_construction}, "
+          f"built in {report['build_s']:.1f}s" + (f", reloaded in {report['load_s']:.2f}s" if args.save else ""))
+    columns = list(next(iter(report["results"].values())).keys())
+    print(f"{'search':<10}" + "".join(f"{column:>14}" for column in columns))
+    for name, row in report["results"].items():
+        print(f"{name:<10}" + "".join(f"{value:>14.4f}" for value in row.values()))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""IVF-PQ compressed vector index.
+
+Vectors are partitioned by a k-means coarse quantiser into ``nlist`` inverted
+lists, and each vector's residual from its list centroid is product-quantised:
+the 384 dimensions are split into ``m`` sub-vectors and each is replaced by the
+index (one byte) of its nearest centroid in that subspace's 256-entry codebook.
+A vector then costs ``m`` bytes plus a 4-byte row id instead of 1536 bytes.
+
+Queries use asymmetric distance computation (ADC): the query stays exact and
+one ``(m, 256)`` table of sub-vector inner products, computed once per query,
+turns scoring a list into ``m`` table lookups per code. On unit vectors
+``q . x ~= q . centroid + sum_j table[j, code_j]``, so the table is shared by
+every probed list. The ``rerank`` best candidates can optionally be re-scored
+exactly against the raw vectors, which may stay on disk (memory-mapped).
+
+    python embedding_ivfpq.py report --m 48 --nprobe 4 8 16 --rerank 0 100
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from embedding_search import ExactIndex, corpus_vectors, normalize_rows, synthetic_vectors, top_k
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means with k-means++ seeding; returns ``(k, dim)`` float32 centroids."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    k = min(k, len(data))
+    squared_norms = np.einsum("ij,ij->i", data, data)
+    centroids = np.empty((k, data.shape[1]), dtype=np.float32)
+    centroids[0] = data[rng.integers(len(data))]
+    closest = squared_norms - 2 * data @ centroids[0] + centroids[0] @ centroids[0]
+    for i in range(1, k):
+        weights = np.maximum(closest, 0)
+        total = weights.sum()
+        pick = rng.choice(len(data), p=weights / total) if total > 0 else rng.integers(len(data))
+        centroids[i] = data[pick]
+        closest = np.minimum(closest, squared_norms - 2 * data @ centroids[i] + centroids[i] @ centroids[i])
+    for _ in range(iterations):
+        assignment = assign(data, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters on random points
+        centroids[empty] = data[rng.integers(0, len(data), int(empty.sum()))]
+    return centroids
+
+
+def assign(data: np.ndarray, centroids: np.ndarray, block: int = 65536) -> np.ndarray:
+    """Index of the nearest centroid (L2) for every row, computed in blocks."""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), block):
+        rows = data[start:start + block]
+        out[start:start + block] = np.argmin(centroid_norms - 2 * rows @ centroids.T, axis=1)
+    return out
+
+
+class IvfPqIndex:
+    def __init__(self, nlist: int, m: int, nprobe: int = 8, rerank: int = 0, seed: int = 0):
+        self.nlist = nlist
+        self.m = m
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.seed = seed
+        self.ids: list[str] = []
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        # codebooks[j] holds the 256 centroids of subspace j
+        self.codebooks = np.empty((0, 256, 0), dtype=np.float32)
+        # Codes and row ids are stored list by list; list i is offsets[i]:offsets[i + 1]
+        self.codes = np.empty((0, m), dtype=np.uint8)
+        self.rows = np.empty(0, dtype=np.int32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.raw: np.ndarray | None = None
+        # Caller-defined digest of what the index was built from, saved with it
+        self.source = ""
+        # Code position and list of every row, built on the first filtered search
+        self._positions: np.ndarray | None = None
+        self._row_lists: np.ndarray | None = None
+        self._rows_by_id: dict[str, int] | None = None
+
+    @classmethod
+    def build(cls, ids: list[str], vectors: np.ndarray, nlist: int | None = None, m: int = 48,
+              nprobe: int = 8, rerank: int = 0, keep_vectors: bool = False, iterations: int = 20,
+              train_size: int = 65536, seed: int = 0) -> "IvfPqIndex":
+        """Train the coarse quantiser and PQ codebooks on (a sample of) ``vectors`` and encode them all."""
+        vectors = normalize_rows(vectors)
+        dim = vectors.shape[1]
+        if dim % m:
+            raise ValueError(f"m={m} must divide the vector dimension {dim}")
+        nlist = nlist or max(1, int(np.sqrt(len(vectors))))
+        index = cls(nlist, m, nprobe, rerank, seed)
+        index.ids = list(ids)
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.permutation(len(vectors))[:train_size]]
+
+        index.centroids = kmeans(sample, nlist, iterations, seed)
+        index.nlist = len(index.centroids)
+        lists = assign(vectors, index.centroids)
+        residuals = vectors - index.centroids[lists]
+
+        sub_dim = dim // m
+        sample_lists = assign(sample, index.centroids)
+        sample_residuals = (sample - index.centroids[sample_lists]).reshape(len(sample), m, sub_dim)
+        index.codebooks = np.zeros((m, 256, sub_dim), dtype=np.float32)
+        for j in range(m):
+            trained = kmeans(sample_residuals[:, j], 256, iterations, seed + j)
+            index.codebooks[j, :len(trained)] = trained
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+        split = residuals.reshape(len(vectors), m, sub_dim)
+        for j in range(m):
+            codes[:, j] = assign(split[:, j], index.codebooks[j])
+
+        order = np.argsort(lists, kind="stable")
+        index.codes = np.ascontiguousarray(codes[order])
+        index.rows = order.astype(np.int32)
+        index.offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=index.nlist))]).astype(np.int64)
+        if keep_vectors:
+            index.raw = vectors
+        return index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _index_rows(self) -> None:
+        self._positions = np.empty(len(self.rows), dtype=np.int32)
+        self._positions[self.rows] = np.arange(len(self.rows), dtype=np.int32)
+        self._row_lists = np.repeat(np.arange(self.nlist, dtype=np.int32), np.diff(self.offsets))
+
+    def search(self, query: np.ndarray, k: int, rows: np.ndarray | None = None, nprobe: int | None = None,
+               rerank: int | None = None) -> tuple[list[str], np.ndarray]:
+        """Return the ids and (approximate, or exact when re-ranked) cosine scores of the top ``k``.
+
+        With ``rows`` the codes of exactly those rows are scored, whichever
+        lists they are in, instead of probing the nearest lists.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        rerank = self.rerank if rerank is None else rerank
+
+        coarse = self.centroids @ query
+        if rows is not None:
+            if len(rows) == 0:
+                return [], np.empty(0, dtype=np.float32)
+            if rerank and self.raw is not None and len(rows) <= max(rerank, k):
+                # Every allowed row would be re-ranked anyway: score them exactly
+                scores = np.asarray(self.raw[rows] @ query)
+                best = top_k(scores, k)
+                return [self.ids[row] for row in rows[best]], scores[best]
+            if self._positions is None:
+                self._index_rows()
+            positions = self._positions[rows]
+            codes = self.codes[positions]
+            base = coarse[self._row_lists[positions]]
+        else:
+            probed = top_k(coarse, nprobe)
+            spans = [(self.offsets[i], self.offsets[i + 1]) for i in probed]
+            if not any(end > start for start, end in spans):
+                return [], np.empty(0, dtype=np.float32)
+            codes = np.concatenate([self.codes[start:end] for start, end in spans])
+            rows = np.concatenate([self.rows[start:end] for start, end in spans])
+            base = np.concatenate([np.full(end - start, coarse[i], dtype=np.float32)
+                                   for i, (start, end) in zip(probed, spans)])
+
+        # ADC: one table of sub-vector inner products, then m lookups per code
+        table = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.m, -1))
+        scores = base + table[np.arange(self.m), codes].sum(axis=1)
+
+        if rerank and self.raw is not None:
+            candidates = top_k(scores, max(rerank, k))
+            rows = rows[candidates]
+            # Read raw rows in file order, which is kind to a memory-mapped matrix
+            order = np.argsort(rows)
+            scores = np.empty(len(rows), dtype=np.float32)
+            scores[order] = self.raw[rows[order]] @ query
+        best = top_k(scores, k)
+        return [self.ids[row] for row in rows[best]], scores[best]
+
+    def vectors_for(self, ids: list[str]) -> np.ndarray:
+        """Vectors of the given chunk ids: exact if raw vectors are kept, else decoded from their codes."""
+        if self._rows_by_id is None:
+            self._rows_by_id = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        rows = np.array([self._rows_by_id[chunk_id] for chunk_id in ids], dtype=np.int64)
+        if self.raw is not None:
+            return np.asarray(self.raw[rows])
+        if self._positions is None:
+            self._index_rows()
+        positions = self._positions[rows]
+        codes = self.codes[positions]
+        residuals = self.codebooks[np.arange(self.m), codes].reshape(len(rows), -1)
+        return normalize_rows(self.centroids[self._row_lists[positions]] + residuals)
+
+    def save(self, path: str) -> None:
+        """Write the compressed index to ``path`` (.npz); raw vectors, if kept, go to ``path + '.vectors.npy'``.
+
+        Both files are written to per-process temporary files and renamed into
+        place, raw vectors first, so workers loading the index while another saves
+        it never see a partial file or an index without its vectors.
+        """
+        tmp = f".{os.getpid()}.tmp"
+        if self.raw is not None:
+            with open(path + ".vectors.npy" + tmp, "wb") as f:
+                np.save(f, np.asarray(self.raw))
+            os.replace(path + ".vectors.npy" + tmp, path + ".vectors.npy")
+        elif os.path.exists(path + ".vectors.npy"):
+            os.remove(path + ".vectors.npy")
+        with open(path + tmp, "wb") as f:
+            np.savez(
+                f,
+                ids=np.array(self.ids, dtype=str),
+                centroids=self.centroids,
+                codebooks=self.codebooks,
+                codes=self.codes,
+                rows=self.rows,
+                offsets=self.offsets,
+                params=np.array(json.dumps({
+                    "nlist": self.nlist, "m": self.m, "nprobe": self.nprobe, "rerank": self.rerank, "seed": self.seed,
+                    "source": self.source,
+                })),
+            )
+        os.replace(path + tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IvfPqIndex":
+        """Load an index; raw vectors saved next to it are memory-mapped, not read into RAM."""
+        with np.load(path, allow_pickle=False) as arrays:
+            params = json.loads(str(arrays["params"]))
+            index = cls(params["nlist"], params["m"], params["nprobe"], params["rerank"], params["seed"])
+            index.ids = arrays["ids"].tolist()
+            index.source = params.get("source", "")
+            for name in ("centroids", "codebooks", "codes", "rows", "offsets"):
+                setattr(index, name, arrays[name])
+        if os.path.exists(path + ".vectors.npy"):
+            index.raw = np.load(path + ".vectors.npy", mmap_mode="r")
+        return index
+
+    def memory(self) -> dict:
+        """Bytes held in RAM, total and per vector (raw vectors count only when not memory-mapped)."""
+        per_vector = self.codes.nbytes + self.rows.nbytes
+        if self._positions is not None:
+            per_vector += self._positions.nbytes + self._row_lists.nbytes
+        fixed = self.centroids.nbytes + self.codebooks.nbytes + self.offsets.nbytes
+        raw = self.raw.nbytes if self.raw is not None and not isinstance(self.raw, np.memmap) else 0
+        count = max(len(self.ids), 1)
+        return {
+            "bytes": int(per_vector + fixed + raw),
+            "bytes_per_vector": (per_vector + raw) / count,
+            "bytes_per_vector_amortised": (per_vector + fixed + raw) / count,
+            "raw_float32_bytes_per_vector": self.codebooks.shape[0] * self.codebooks.shape[2] * 4,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "kind": "ivfpq",
+            "size": len(self.ids),
+            "nlist": self.nlist,
+            "m": self.m,
+            "nprobe": self.nprobe,
+            "rerank": self.rerank if self.raw is not None else 0,
+            **self.memory(),
+        }
+
+
+def recall_report(ids: list[str], vectors: np.ndarray, queries: np.ndarray, k: int, nlist: int | None,
+                  m: int, nprobe_values: list[int], rerank_values: list[int]) -> dict:
+    """Recall@k, latency and memory of IVF-PQ at each nprobe / rerank depth, against exact search."""
+    exact = ExactIndex(ids, vectors)
+    exact_ms = []
+    truth = []
+    for query in queries:
+        started = time.perf_counter()
+        found, _ = exact.search(query, k)
+        exact_ms.append((time.perf_counter() - started) * 1000)
+        truth.append(set(found))
+
+    started = time.perf_counter()
+    index = IvfPqIndex.build(ids, vectors, nlist=nlist, m=m, keep_vectors=any(rerank_values))
+    build_s = time.perf_counter() - started
+
+    rows = {}
+    for nprobe in nprobe_values:
+        for rerank in rerank_values:
+            latencies = []
+            hits = 0
+            for query, expected in zip(queries, truth):
+                started = time.perf_counter()
+                found, _ = index.search(query, k, nprobe=nprobe, rerank=rerank)
+                latencies.append((time.perf_counter() - started) * 1000)
+                hits += len(expected.intersection(found))
+            rows[f"nprobe={nprobe} rerank={rerank}"] = {
+                f"recall@{k}": hits / (k * len(queries)),
+                "mean_ms": float(np.mean(latencies)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+            }
+    rows["exact"] = {
+        f"recall@{k}": 1.0,
+        "mean_ms": float(np.mean(exact_ms)),
+        "p99_ms": float(np.percentile(exact_ms, 99)),
+    }
+    index.raw = None
+    return {"index": index.stats(), "build_s": build_s, "results": rows}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="IVF-PQ index recall/memory report")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_parser = sub.add_parser("report")
+    report_parser.add_argument("--nlist", type=int, default=None, help="inverted lists (default sqrt(n))")
+    report_parser.add_argument("--m", type=int, default=48, help="PQ sub-quantisers (bytes per code)")
+    report_parser.add_argument("--nprobe", nargs="+", type=int, default=[1, 4, 8, 16])
+    report_parser.add_argument("--rerank", nargs="+", type=int, default=[0, 100])
+    report_parser.add_argument("--k", type=int, default=10)
+    report_parser.add_argument("--queries", type=int, default=200)
+    report_parser.add_argument("--synthetic", type=int, default=0,
+                               help="index this many synthetic vectors instead of the chunk corpus")
+    report_parser.add_argument("--model", default=os.environ.get("EMBED_MODEL_NAME", "all-MiniLM-L6-v2"))
+    report_parser.add_argument("--backend", default="torch-fp32")
+    report_parser.add_argument("--json", help="write the report to this file")
+    report_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic + args.queries, 384, clusters=max(8, args.synthetic // 500),
+                                    seed=args.seed)
+        queries, vectors = vectors[:args.queries], vectors[args.queries:]
+        ids = [str(i) for i in range(len(vectors))]
+    else:
+        ids, vectors = corpus_vectors(args.model, args.backend)
+        # Perturbed chunks stand in for queries so no query is its own exact match
+        picks = rng.integers(0, len(vectors), args.queries)
+        queries = normalize_rows(vectors[picks] + 0.05 * rng.standard_normal((args.queries, vectors.shape[1])))
+    report = recall_report(ids, vectors, queries, args.k, args.nlist, args.m, args.nprobe, args.rerank)
+
+    index = report["index"]
+    print(f"{index['size']} vectors, nlist={index['nlist']}, m={index['m']}, built in {report['build_s']:.1f}s; "
+          f"{index['bytes_per_vector']:.0f} B/vector ({index['bytes_per_vector_amortised']:.0f} B amortised) "
+          f"vs {index['raw_float32_bytes_per_vector']} B raw float32")
+    columns = list(next(iter(report["results"].values())).keys())
+    print(f"{'search':<22}" + "".join(f"{column:>14}" for column in columns))
+    for name, row in report["results"].items():
+        print(f"{name:<22}" + "".join(f"{value:>14.4f}" for value in row.values()))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
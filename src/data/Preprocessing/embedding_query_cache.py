@@ -0,0 +1,135 @@
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+
+class QueryResultCache:
+    """LRU cache of search results, looked up by exact query or by query embedding.
+
+    Entries are keyed by (normalised query key, request signature), where the
+    signature covers every parameter that changes the result (mode, top_k,
+    filters, ...). ``get_exact`` is a dict lookup that needs no embedding;
+    ``get_similar`` returns the result of the closest cached query with the same
+    signature if its cosine similarity is at least ``threshold``, using one
+    matrix-vector product over the cached query vectors. Only entries stored with
+    a vector take part in similarity lookups.
+
+    Every entry is stamped with the index version it was computed against; entries
+    from another version are never returned and are dropped when seen, so a
+    corpus rebuild invalidates the cache without an explicit flush.
+    """
+
+    def __init__(self, max_entries: int, threshold: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_ms = 0.0
+        # (query key, signature) -> slot; order is recency
+        self._entries: OrderedDict[tuple[str, str], int] = OrderedDict()
+        # Per slot: (entry key, version, result, compute_ms)
+        self._slots: list[tuple | None] = [None] * max_entries
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._vectors: np.ndarray | None = None
+        # Per slot ids of the signature and version, -1 when the slot has no vector
+        self._slot_signatures = np.full(max_entries, -1, dtype=np.int64)
+        self._slot_versions = np.full(max_entries, -1, dtype=np.int64)
+        # Interned signatures and versions, dropped with the last slot using them
+        self._ids: dict[str, int] = {}
+        self._refs: Counter[str] = Counter()
+        self._next_id = 0
+
+    def _intern(self, value: str) -> int:
+        if value not in self._ids:
+            self._ids[value] = self._next_id
+            self._next_id += 1
+        self._refs[value] += 1
+        return self._ids[value]
+
+    def _release(self, value: str) -> None:
+        self._refs[value] -= 1
+        if self._refs[value] <= 0:
+            del self._refs[value], self._ids[value]
+
+    def _hit(self, slot: int) -> object:
+        key, _, result, compute_ms = self._slots[slot]
+        self._entries.move_to_end(key)
+        self.saved_ms += compute_ms
+        return result
+
+    def _drop(self, slot: int) -> None:
+        key, version = self._slots[slot][:2]
+        del self._entries[key]
+        if self._slot_signatures[slot] >= 0:
+            self._release(key[1])
+            self._release(version)
+        self._slots[slot] = None
+        self._slot_signatures[slot] = -1
+        self._slot_versions[slot] = -1
+        self._free.append(slot)
+
+    def get_exact(self, query_key: str, signature: str, version: str):
+        slot = self._entries.get((query_key, signature))
+        if slot is None:
+            return None
+        if self._slots[slot][1] != version:
+            self._drop(slot)
+            self.invalidations += 1
+            return None
+        self.exact_hits += 1
+        return self._hit(slot)
+
+    def get_similar(self, vector: np.ndarray, signature: str, version: str):
+        if self._vectors is None or self.threshold > 1 or not self._entries:
+            return None
+        signature_id, version_id = self._ids.get(signature), self._ids.get(version)
+        if signature_id is None or version_id is None:
+            return None
+        similarity = self._vectors @ (vector / (np.linalg.norm(vector) or 1.0))
+        candidates = (self._slot_signatures == signature_id) & (self._slot_versions == version_id)
+        similarity[~candidates] = -np.inf
+        slot = int(np.argmax(similarity))
+        if similarity[slot] < self.threshold:
+            return None
+        self.semantic_hits += 1
+        return self._hit(slot)
+
+    def put(self, query_key: str, signature: str, version: str, vector: np.ndarray | None,
+            result, compute_ms: float) -> None:
+        """Store a freshly computed result; ``vector`` enables semantic lookups of it."""
+        self.misses += 1
+        if self.max_entries <= 0:
+            return
+        key = (query_key, signature)
+        if key in self._entries:
+            self._drop(self._entries[key])
+        if not self._free:
+            self._drop(next(iter(self._entries.values())))
+            self.evictions += 1
+        slot = self._free.pop()
+        self._entries[key] = slot
+        self._slots[slot] = (key, version, result, compute_ms)
+        if vector is not None:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            self._vectors[slot] = vector / (np.linalg.norm(vector) or 1.0)
+            self._slot_signatures[slot] = self._intern(signature)
+            self._slot_versions[slot] = self._intern(version)
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "saved_ms": self.saved_ms,
+        }
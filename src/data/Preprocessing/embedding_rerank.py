@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ScoreCache:
+    """Thread-safe LRU of cross-encoder scores keyed by (query key, chunk id)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._scores: OrderedDict[tuple[str, str], float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, query_key: str, chunk_ids: list[str]) -> list[float | None]:
+        scores = []
+        with self._lock:
+            for chunk_id in chunk_ids:
+                score = self._scores.get((query_key, chunk_id))
+                if score is None:
+                    self.misses += 1
+                else:
+                    self._scores.move_to_end((query_key, chunk_id))
+                    self.hits += 1
+                scores.append(score)
+        return scores
+
+    def put_many(self, query_key: str, chunk_ids: list[str], scores) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for chunk_id, score in zip(chunk_ids, scores):
+                self._scores[(query_key, chunk_id)] = float(score)
+                self._scores.move_to_end((query_key, chunk_id))
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._scores),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CrossEncoderReranker:
+    """Re-score (query, chunk text) pairs with a local cross-encoder.
+
+    All pairs whose score is not cached are scored in one batched forward pass;
+    ``rerank`` is blocking and belongs on the inference executor.
+    """
+
+    def __init__(self, model_name: str, revision: str | None = None, max_length: int = 256,
+                 cache_entries: int = 100_000):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, revision=revision, max_length=max_length, device="cpu")
+        self.cache = ScoreCache(cache_entries)
+        self.pairs_scored = 0
+
+    def score(self, query: str, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.empty(0, dtype=np.float32)
+        scores = self.model.predict([(query, text) for text in texts], batch_size=len(texts),
+                                    show_progress_bar=False)
+        self.pairs_scored += len(texts)
+        return np.asarray(scores, dtype=np.float32).reshape(len(texts))
+
+    def rerank(self, query: str, query_key: str, chunk_ids: list[str],
+               texts: list[str], top_n: int) -> tuple[list[str], np.ndarray, int]:
+        """Return the ``top_n`` chunk ids, their scores and how many scores came from the cache."""
+        scores = self.cache.get_many(query_key, chunk_ids)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            computed = self.score(query, [texts[i] for i in missing])
+            self.cache.put_many(query_key, [chunk_ids[i] for i in missing], computed)
+            for i, score in zip(missing, computed):
+                scores[i] = float(score)
+        scores = np.array(scores, dtype=np.float32)
+        order = np.argsort(-scores, kind="stable")[:top_n]
+        return [chunk_ids[i] for i in order], scores[order], len(chunk_ids) - len(missing)
+
+    def stats(self) -> dict:
+        return {"pairs_scored": self.pairs_scored, "cache": self.cache.stats()}
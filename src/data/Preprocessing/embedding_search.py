@@ -0,0 +1,198 @@
+import json
+import os
+import re
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CHUNK_FILES = (
+    os.path.join(HERE, "..", "processed", "all_product_chunks.json"),
+    os.path.join(HERE, "..", "preprocessed", "all_companies_preprocessed.json"),
+)
+
+# Processed chunk ids start with the company id, e.g. "aar_001_aar_shwaari_001_<uuid>"
+COMPANY_PREFIX = re.compile(r"^([a-z]+_\d{3})_")
+
+
+def _chunk_metadata(chunk: dict) -> dict:
+    if "metadata" in chunk:
+        # Processed files: one chunk per company or product, fields under "metadata"
+        metadata = chunk["metadata"]
+        match = COMPANY_PREFIX.match(chunk["chunk_id"])
+        product_id = metadata.get("product_id")
+        return {
+            "company_id": metadata.get("company_id") or (match.group(1) if match else None),
+            "product_id": product_id,
+            "chunk_type": "product_metadata" if product_id else "company_metadata",
+            "category": metadata.get("category"),
+        }
+    return {
+        "company_id": chunk.get("company_id"),
+        "product_id": chunk.get("product_id"),
+        "chunk_type": chunk.get("chunk_type"),
+        "category": (chunk.get("raw_data") or {}).get("category"),
+    }
+
+
+def load_chunks(paths: list[str], with_payload: bool = False) -> list[dict]:
+    """Load chunk records from chunk files, first occurrence of an id wins.
+
+    Each record has ``chunk_id``, ``text``, ``company_id``, ``product_id``,
+    ``chunk_type`` and ``category``, plus the record as read from the file under
+    ``payload`` when ``with_payload`` is set. Only product metadata chunks carry a
+    category, so it is copied to every chunk of the same product.
+    """
+    chunks = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for chunk in json.load(f):
+                if chunk.get("text") and chunk["chunk_id"] not in chunks:
+                    chunks[chunk["chunk_id"]] = {
+                        "chunk_id": chunk["chunk_id"],
+                        "text": chunk["text"],
+                        **_chunk_metadata(chunk),
+                    }
+                    if with_payload:
+                        chunks[chunk["chunk_id"]]["payload"] = chunk
+    categories = {}
+    for chunk in chunks.values():
+        if chunk["product_id"] and chunk["category"]:
+            categories.setdefault(chunk["product_id"], chunk["category"])
+    for chunk in chunks.values():
+        if not chunk["category"] and chunk["product_id"]:
+            chunk["category"] = categories.get(chunk["product_id"])
+    return list(chunks.values())
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Return a C-contiguous float32 copy with unit-length rows."""
+    vectors = np.array(vectors, dtype=np.float32, order="C")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Row indices of the ``k`` highest scores, best first.
+
+    ``argpartition`` selects the top k in O(n); only those k are then sorted.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class ExactIndex:
+    """Exact cosine search over an in-memory matrix of unit-length vectors.
+
+    One matrix-vector product scores every chunk; at a few thousand 384-dim rows
+    that is far cheaper than a network hop to a hosted vector database.
+    """
+
+    def __init__(self, ids: list[str], vectors: np.ndarray):
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors must have the same length")
+        self.ids = list(ids)
+        self.vectors = normalize_rows(vectors)
+        self._rows_by_id: dict[str, int] | None = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: np.ndarray, k: int, rows: np.ndarray | None = None) -> tuple[list[str], np.ndarray]:
+        """Return the ids and cosine scores of the ``k`` nearest chunks, among ``rows`` if given.
+
+        Only the given rows are scored. A contiguous run of rows (chunks are
+        indexed sorted by company and product) is scored as a slice, without
+        copying the matrix.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        if rows is None:
+            matrix = self.vectors
+        elif len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            matrix = self.vectors[rows[0]:rows[-1] + 1]
+        else:
+            matrix = self.vectors[rows]
+        scores = matrix @ query
+        best = top_k(scores, k)
+        picked = best if rows is None else rows[best]
+        return [self.ids[row] for row in picked], scores[best]
+
+    def vectors_for(self, ids: list[str]) -> np.ndarray:
+        """Unit vectors of the given chunk ids, in order."""
+        if self._rows_by_id is None:
+            self._rows_by_id = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        return self.vectors[[self._rows_by_id[chunk_id] for chunk_id in ids]]
+
+    def stats(self) -> dict:
+        return {
+            "kind": "exact",
+            "size": len(self.ids),
+            "dim": int(self.vectors.shape[1]) if len(self.ids) else 0,
+            "bytes": int(self.vectors.nbytes),
+        }
+
+
+def synthetic_vectors(count: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Unit vectors drawn around random cluster centres, a stand-in for a larger corpus."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    return normalize_rows(vectors)
+
+
+def corpus_vectors(model_name: str, backend_name: str) -> tuple[list[str], np.ndarray]:
+    """Encode the default chunk files for offline index reports."""
+    from embedding_backends import encode_all, load_backend
+
+    chunks = load_chunks(list(DEFAULT_CHUNK_FILES))
+    backend = load_backend(backend_name, model_name)
+    return [chunk["chunk_id"] for chunk in chunks], encode_all(backend, [chunk["text"] for chunk in chunks], 64)
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[tuple[str, float]]:
+    """Fuse ranked id lists by summing ``1 / (k + rank)``; best fused score first."""
+    fused: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, k: int, lambda_: float) -> np.ndarray:
+    """Pick ``k`` candidates by maximal marginal relevance; returns their positions in pick order.
+
+    Each step takes the candidate maximising
+    ``lambda_ * relevance - (1 - lambda_) * max cosine to the picks so far``.
+    Relevance is min-max scaled to [0, 1] so it is comparable with cosine whatever
+    the retrieval score. The candidate similarity matrix is computed once and the
+    running maximum is updated with one vector operation per pick.
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones(n, dtype=np.float32)
+    similarity = vectors @ vectors.T
+    max_similarity = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    picks = np.empty(k, dtype=np.int64)
+    for step in range(k):
+        if step == 0:
+            gain = relevance
+        else:
+            gain = lambda_ * relevance - (1 - lambda_) * max_similarity
+        pick = int(np.argmax(np.where(available, gain, -np.inf)))
+        picks[step] = pick
+        available[pick] = False
+        max_similarity = np.maximum(max_similarity, similarity[pick])
+    return picks
@@ -1,13 +1,342 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
+import time
+
+# Reference point for import-to-ready time
+PROCESS_STARTED = time.perf_counter()
+
+import asyncio
+import hashlib
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Literal
+
+import numpy as np
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, model_validator
 import uvicorn
 
-# Load embedding model once on startup
-model = SentenceTransformer("all-MiniLM-L6-v2")
+from embedding_backends import load_backend
+from embedding_bm25 import Bm25Index
+from embedding_batcher import MicroBatcher, PaddingStats, length_sorted_batches
+from embedding_cache import EmbeddingCache, text_key
+from embedding_chunk_store import ChunkStore
+from embedding_codec import vectors_response
+from embedding_executor import InferenceExecutor, Overloaded
+from embedding_filters import FILTER_FIELDS, MetadataBitmaps
+from embedding_hnsw import HnswIndex
+from embedding_ivfpq import IvfPqIndex
+from embedding_metrics import (
+    BATCH_SIZE_BUCKETS,
+    CONTENT_TYPE,
+    TOKEN_BUCKETS,
+    MetricsMiddleware,
+    Registry,
+)
+from embedding_query_cache import QueryResultCache
+from embedding_rerank import CrossEncoderReranker
+from embedding_search import DEFAULT_CHUNK_FILES, ExactIndex, load_chunks, mmr_select, reciprocal_rank_fusion
+from embedding_singleflight import SingleFlight
+from embedding_store import EmbeddingStore
+from embedding_stream import NdjsonEmbedEndpoint
+
+# Model to serve; the revision pins the exact weights and keys the persistent store
+MODEL_NAME = os.environ.get("EMBED_MODEL_NAME", "all-MiniLM-L6-v2")
+MODEL_REVISION = os.environ.get("EMBED_MODEL_REVISION") or None
+# CPU inference backend: torch-fp32, torch-int8 or onnx
+BACKEND = os.environ.get("EMBED_BACKEND", "torch-fp32")
+# Internal batch size used for vectorised encode calls
+BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "64"))
+# Upper bound on the number of texts accepted by one /embed/batch request
+MAX_BATCH_TEXTS = int(os.environ.get("EMBED_MAX_BATCH_TEXTS", "4096"))
+# Concurrent /embed calls are grouped for at most this window or batch size
+MICROBATCH_WAIT_MS = float(os.environ.get("EMBED_MICROBATCH_WAIT_MS", "5"))
+MICROBATCH_MAX_SIZE = int(os.environ.get("EMBED_MICROBATCH_MAX_SIZE", "32"))
+# Model calls run with fixed concurrency; at most this many more may wait before
+# requests are shed with 503 + Retry-After
+INFERENCE_CONCURRENCY = int(os.environ.get("EMBED_INFERENCE_CONCURRENCY", "1"))
+INFERENCE_MAX_QUEUE = int(os.environ.get("EMBED_INFERENCE_MAX_QUEUE", "64"))
+MICROBATCH_MAX_PENDING = int(os.environ.get("EMBED_MICROBATCH_MAX_PENDING", "1024"))
+# Lines per internal batch on the NDJSON streaming endpoint
+STREAM_BATCH_SIZE = int(os.environ.get("EMBED_STREAM_BATCH_SIZE", "64"))
+# In-process query cache, bounded by memory and optionally by age (0 disables TTL)
+CACHE_MAX_MB = float(os.environ.get("EMBED_CACHE_MAX_MB", "64"))
+CACHE_TTL_SECONDS = float(os.environ.get("EMBED_CACHE_TTL_SECONDS", "0"))
+# Warm-up batches run at these token lengths before the service reports ready
+WARMUP_LENGTHS = [int(n) for n in os.environ.get("EMBED_WARMUP_LENGTHS", "16,64,128,256").split(",") if n]
+WARMUP_BATCH_SIZE = int(os.environ.get("EMBED_WARMUP_BATCH_SIZE", "8"))
+# On-disk vector store shared by all workers and restarts (empty disables it)
+STORE_PATH = os.environ.get(
+    "EMBED_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_store.sqlite3"),
+)
+# Chunk payloads served with /search matches and by /chunks/fetch, synced from the
+# chunk files at startup (empty disables it)
+CHUNK_STORE_PATH = os.environ.get(
+    "EMBED_CHUNK_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "chunk_store.sqlite3"),
+)
+CHUNK_FETCH_MAX_IDS = int(os.environ.get("EMBED_CHUNK_FETCH_MAX_IDS", "1000"))
+# Chunk files the chunk store is synced from, independent of the /search index
+CHUNK_FILES = [
+    path for path in os.environ.get("EMBED_CHUNK_FILES", os.pathsep.join(DEFAULT_CHUNK_FILES)).split(os.pathsep)
+    if path
+]
+# Chunk files embedded into the in-memory /search index at startup (empty disables it)
+SEARCH_CHUNK_FILES = [
+    path for path in os.environ.get("EMBED_SEARCH_CHUNK_FILES", os.pathsep.join(DEFAULT_CHUNK_FILES)).split(os.pathsep)
+    if path
+]
+# Default and maximum number of matches returned by /search
+SEARCH_DEFAULT_TOP_K = int(os.environ.get("EMBED_SEARCH_DEFAULT_TOP_K", "30"))
+SEARCH_MAX_TOP_K = int(os.environ.get("EMBED_SEARCH_MAX_TOP_K", "200"))
+# Default retrieval mode: "dense" (vectors), "bm25" (terms) or "hybrid" (both, fused by
+# reciprocal rank fusion over the top FUSION_DEPTH of each leg)
+SEARCH_MODE = os.environ.get("EMBED_SEARCH_MODE", "hybrid")
+SEARCH_FUSION_DEPTH = int(os.environ.get("EMBED_SEARCH_FUSION_DEPTH", "100"))
+SEARCH_RRF_K = int(os.environ.get("EMBED_SEARCH_RRF_K", "60"))
+# Maximal marginal relevance: default lambda (1 = pure relevance, empty disables) and
+# how many candidates it diversifies over
+SEARCH_MMR_LAMBDA = float(os.environ["EMBED_SEARCH_MMR_LAMBDA"]) if os.environ.get("EMBED_SEARCH_MMR_LAMBDA") else None
+SEARCH_MMR_POOL = int(os.environ.get("EMBED_SEARCH_MMR_POOL", "100"))
+# Search index: "exact" (brute force), "hnsw" (approximate, for large corpora) or
+# "ivfpq" (compressed, for memory-constrained nodes)
+SEARCH_INDEX = os.environ.get("EMBED_SEARCH_INDEX", "exact")
+# HNSW build and query parameters; a saved graph is reused if its chunk ids still match.
+# Building takes milliseconds per chunk, so build the graph once (one process with
+# EMBED_HNSW_PATH set) and let every other process load it; serve_prefork.py
+# requires the path in hnsw mode
+HNSW_M = int(os.environ.get("EMBED_HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("EMBED_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.environ.get("EMBED_HNSW_EF_SEARCH", "64"))
+HNSW_PATH = os.environ.get("EMBED_HNSW_PATH", "")
+# IVF-PQ lists (0 = sqrt(n)), bytes per code, lists probed per query and candidates
+# re-scored exactly; with a path, raw vectors for re-ranking stay memory-mapped on disk
+IVFPQ_NLIST = int(os.environ.get("EMBED_IVFPQ_NLIST", "0"))
+IVFPQ_M = int(os.environ.get("EMBED_IVFPQ_M", "48"))
+IVFPQ_NPROBE = int(os.environ.get("EMBED_IVFPQ_NPROBE", "8"))
+IVFPQ_RERANK = int(os.environ.get("EMBED_IVFPQ_RERANK", "100"))
+IVFPQ_PATH = os.environ.get("EMBED_IVFPQ_PATH", "")
+# Optional cross-encoder that re-ranks /search candidates into a short top_n (empty
+# disables it); scores are cached per (query, chunk) pair
+RERANK_MODEL = os.environ.get("EMBED_RERANK_MODEL", "")
+RERANK_TOP_N = int(os.environ.get("EMBED_RERANK_TOP_N", "8"))
+RERANK_MAX_LENGTH = int(os.environ.get("EMBED_RERANK_MAX_LENGTH", "256"))
+RERANK_CACHE_ENTRIES = int(os.environ.get("EMBED_RERANK_CACHE_ENTRIES", "100000"))
+# /search result cache: entries (0 disables it) and the cosine similarity at which a
+# new query reuses a cached query's results (above 1 allows exact repeats only)
+QUERY_CACHE_ENTRIES = int(os.environ.get("EMBED_QUERY_CACHE_ENTRIES", "10000"))
+QUERY_CACHE_THRESHOLD = float(os.environ.get("EMBED_QUERY_CACHE_THRESHOLD", "0.95"))
+
+logger = logging.getLogger("uvicorn.error")
+
+# Prometheus metrics served on /metrics
+metrics = Registry()
+request_seconds = metrics.histogram(
+    "embedding_request_duration_seconds", "End-to-end request latency", labelnames=("endpoint",))
+requests_total = metrics.counter(
+    "embedding_requests_total", "Requests by endpoint and status", labelnames=("endpoint", "status"))
+in_flight = metrics.gauge(
+    "embedding_requests_in_flight", "Requests currently being handled", labelnames=("endpoint",))
+batch_wait_seconds = metrics.histogram(
+    "embedding_batch_wait_seconds", "Time a single /embed request waited for its micro-batch")
+queue_wait_seconds = metrics.histogram(
+    "embedding_queue_wait_seconds", "Time an encode job waited for an inference thread")
+inference_seconds = metrics.histogram(
+    "embedding_inference_seconds", "Time an encode job ran on an inference thread")
+batch_size_hist = metrics.histogram(
+    "embedding_batch_size", "Texts per encoded batch", buckets=BATCH_SIZE_BUCKETS)
+batch_tokens_hist = metrics.histogram(
+    "embedding_batch_tokens", "Padded tokens per encoded batch", buckets=TOKEN_BUCKETS)
+not_ready_total = metrics.counter(
+    "embedding_not_ready_rejections_total", "Requests rejected because the model was not ready")
+
+# The model is loaded in the startup phase, not at import time, so the process
+# answers /livez immediately and only reports /readyz once warm
+backend = None
+search_index = None
+search_bitmaps = None
+bm25_index = None
+reranker = None
+# Identifies the corpus and index configuration; cached /search results are only
+# served for the version they were computed against
+search_version = ""
+query_cache = QueryResultCache(QUERY_CACHE_ENTRIES, QUERY_CACHE_THRESHOLD)
+# Chunk text by id, for re-ranking
+chunk_texts: dict[str, str] = {}
+startup = {
+    "phase": "starting",
+    "error": None,
+    "load_s": None,
+    "warmup_s": None,
+    "index_s": None,
+    "ready_s": None,
+}
+# Phases in which the model itself can encode requests; "index_failed" means the
+# chunk store or search index could not be built, which only affects /search and
+# /chunks/fetch
+MODEL_READY_PHASES = ("indexing", "ready", "index_failed")
+
+def load_model():
+    """Load the inference backend once; the pre-fork parent calls this before forking."""
+    global backend
+    if backend is None:
+        started = time.perf_counter()
+        backend = load_backend(BACKEND, MODEL_NAME, MODEL_REVISION)
+        startup["load_s"] = time.perf_counter() - started
+    return backend
+
+def load_reranker() -> None:
+    """Load the cross-encoder; a failure only disables re-ranking."""
+    global reranker
+    try:
+        reranker = CrossEncoderReranker(RERANK_MODEL, max_length=RERANK_MAX_LENGTH, cache_entries=RERANK_CACHE_ENTRIES)
+    except Exception:
+        logger.exception("Re-ranking model %s failed to load; re-ranking is disabled", RERANK_MODEL)
+
+def warm_up() -> None:
+    """Run warm-up batches at representative sequence lengths."""
+    for length in WARMUP_LENGTHS:
+        # Two special tokens plus roughly one token per word
+        text = " ".join(["insurance"] * max(1, length - 2))
+        backend.encode([text] * WARMUP_BATCH_SIZE)
+        if reranker is not None:
+            reranker.score("insurance", [text] * WARMUP_BATCH_SIZE)
+
+class NotReady(Overloaded):
+    """Raised when a request needs the model or index before startup has finished."""
+
+    def __init__(self):
+        super().__init__(5, reason=f"service is {startup['phase']}")
+
+def ensure_ready(phases: tuple[str, ...] = MODEL_READY_PHASES) -> None:
+    if startup["phase"] not in phases:
+        not_ready_total.inc()
+        raise NotReady()
+
+async def start_model() -> None:
+    try:
+        startup["phase"] = "loading"
+        await asyncio.to_thread(load_model)
+        if RERANK_MODEL:
+            await asyncio.to_thread(load_reranker)
+        startup["phase"] = "warming"
+        started = time.perf_counter()
+        # Warm up on the inference thread itself so its thread pools are primed
+        await inference_executor.run(warm_up)
+        startup["warmup_s"] = time.perf_counter() - started
+    except Exception as exc:
+        startup["phase"] = "failed"
+        startup["error"] = repr(exc)
+        logger.exception("Embedding model failed to load")
+        return
+    try:
+        if chunk_store is not None or SEARCH_CHUNK_FILES:
+            startup["phase"] = "indexing"
+            started = time.perf_counter()
+            if chunk_store is not None:
+                await sync_chunk_store()
+            if SEARCH_CHUNK_FILES:
+                await build_search_index()
+            startup["index_s"] = time.perf_counter() - started
+    except Exception as exc:
+        # The model is warm, so /embed keeps serving
+        startup["phase"] = "index_failed"
+        startup["error"] = repr(exc)
+        logger.exception("Chunk store or search index failed to build; /search and /chunks/fetch are unavailable")
+        return
+    startup["ready_s"] = time.perf_counter() - PROCESS_STARTED
+    startup["phase"] = "ready"
+    logger.info(
+        "Embedding service ready in %.1fs (load %.1fs, warm-up %.1fs, index %.1fs)",
+        startup["ready_s"], startup["load_s"], startup["warmup_s"], startup["index_s"] or 0.0,
+    )
+
+# Bounded inference executor; one thread by default so batches never compete
+# for torch's intra-op threads
+inference_executor = InferenceExecutor(
+    INFERENCE_CONCURRENCY,
+    INFERENCE_MAX_QUEUE,
+    on_wait=queue_wait_seconds.observe,
+    on_service=inference_seconds.observe,
+)
+
+padding = PaddingStats()
+
+def encode_texts(texts: list[str], lengths: np.ndarray | None = None) -> np.ndarray:
+    """Encode texts in one vectorised forward pass and record its padding."""
+    if lengths is None:
+        lengths = backend.token_lengths(texts)
+    padding.record(lengths)
+    batch_size_hist.observe(len(texts))
+    batch_tokens_hist.observe(int(lengths.max()) * len(texts))
+    return backend.encode(texts)
+
+cache = EmbeddingCache(int(CACHE_MAX_MB * 1024 * 1024), ttl_seconds=CACHE_TTL_SECONDS)
+# Backends produce slightly different vectors, so each gets its own store namespace
+store = (
+    EmbeddingStore(STORE_PATH, f"{MODEL_NAME}:{BACKEND}", MODEL_REVISION or "main")
+    if STORE_PATH else None
+)
+chunk_store = ChunkStore(CHUNK_STORE_PATH) if CHUNK_STORE_PATH else None
+
+async def lookup_vectors(keys: list[str]) -> list[np.ndarray | None]:
+    """Look keys up in the memory cache, then in the persistent store."""
+    vectors = [cache.get(key) for key in keys]
+    missing = [key for key, vector in zip(keys, vectors) if vector is None]
+    if store is not None and missing:
+        found = await asyncio.to_thread(store.get_many, missing)
+        for i, key in enumerate(keys):
+            if vectors[i] is None and key in found:
+                cache.put(key, found[key])
+                vectors[i] = found[key]
+    return vectors
+
+async def remember_vectors(keys: list[str], vectors) -> None:
+    """Write freshly computed vectors to the memory cache and persistent store."""
+    for key, vector in zip(keys, vectors):
+        cache.put(key, vector)
+    if store is not None:
+        await asyncio.to_thread(store.put_many, list(zip(keys, vectors)))
+
+# Identical texts being computed by other requests are awaited, not recomputed
+singleflight = SingleFlight()
+
+batcher = MicroBatcher(
+    encode_texts,
+    inference_executor,
+    max_batch_size=MICROBATCH_MAX_SIZE,
+    max_wait_ms=MICROBATCH_WAIT_MS,
+    max_pending=MICROBATCH_MAX_PENDING,
+    on_wait=batch_wait_seconds.observe,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await batcher.start()
+    startup_task = asyncio.create_task(start_model())
+    yield
+    startup_task.cancel()
+    await batcher.stop()
+    inference_executor.shutdown()
 
 # FastAPI app
-app = FastAPI(title="Embedding Service")
+app = FastAPI(title="Embedding Service", lifespan=lifespan)
+app.add_middleware(
+    MetricsMiddleware,
+    duration=request_seconds,
+    in_flight=in_flight,
+    requests=requests_total,
+    paths={"/embed", "/embed/batch", "/embed/stream", "/search", "/chunks/fetch"},
+)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        {"detail": str(exc)},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 # Request schema
 class TextIn(BaseModel):
@@ -17,11 +346,517 @@ class TextIn(BaseModel):
 class EmbeddingOut(BaseModel):
     embedding: list[float]
 
+# Batch request schema
+class BatchIn(BaseModel):
+    texts: list[str]
+    ids: list[str] | None = None
+    batch_size: int | None = None
+
+    @model_validator(mode="after")
+    def check_batch(self):
+        if not self.texts:
+            raise ValueError("texts must not be empty")
+        if len(self.texts) > MAX_BATCH_TEXTS:
+            raise ValueError(f"at most {MAX_BATCH_TEXTS} texts per request")
+        if self.ids is not None and len(self.ids) != len(self.texts):
+            raise ValueError("ids must have the same length as texts")
+        if self.batch_size is not None and self.batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        return self
+
+# Timing of one internal encode batch
+class BatchTiming(BaseModel):
+    index: int
+    size: int
+    tokens: int
+    padded_tokens: int
+    ms: float
+
+# Batch response schema, embeddings are in input order
+class BatchEmbeddingOut(BaseModel):
+    ids: list[str] | None = None
+    embeddings: list[list[float]]
+    cached: int
+    batches: list[BatchTiming]
+    total_ms: float
+
+def encode_in_batches(texts: list[str], batch_size: int) -> tuple[np.ndarray, list[BatchTiming]]:
+    """Encode texts in length-bucketed vectorised batches, keeping input order."""
+    lengths = backend.token_lengths(texts)
+    vectors = None
+    timings = []
+    for index, rows in enumerate(length_sorted_batches(lengths, batch_size)):
+        started = time.perf_counter()
+        encoded = encode_texts([texts[i] for i in rows], lengths[rows])
+        if vectors is None:
+            vectors = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+        vectors[rows] = encoded
+        timings.append(BatchTiming(
+            index=index,
+            size=len(rows),
+            tokens=int(lengths[rows].sum()),
+            padded_tokens=int(lengths[rows].max()) * len(rows),
+            ms=(time.perf_counter() - started) * 1000,
+        ))
+    return vectors, timings
+
+async def embed_one(text: str) -> np.ndarray:
+    """Embed one text through the cache and store, micro-batching a miss with other requests."""
+    key = text_key(text)
+    [embedding] = await lookup_vectors([key])
+    if embedding is None:
+        ensure_ready()
+
+        async def compute(owned: list[str]) -> list[np.ndarray]:
+            vector = await batcher.submit(text)
+            await remember_vectors(owned, [vector])
+            return [vector]
+
+        [embedding] = await singleflight.run([key], compute)
+    return embedding
+
 @app.post("/embed", response_model=EmbeddingOut)
-def embed_text(payload: TextIn):
-    """Return 384-dim embedding for input text"""
-    embedding = model.encode(payload.text).tolist()
-    return EmbeddingOut(embedding=embedding)
+async def embed_text(payload: TextIn, accept: str | None = Header(default=None)):
+    """Return 384-dim embedding for input text, as JSON, base64 JSON or raw bytes per Accept"""
+    embedding = await embed_one(payload.text)
+    response = vectors_response(embedding, accept)
+    if response is not None:
+        return response
+    return EmbeddingOut(embedding=embedding.tolist())
+
+async def embed_many(texts: list[str], batch_size: int) -> tuple[np.ndarray, int, list[BatchTiming]]:
+    """Embed texts through the cache and store, encoding each distinct miss once."""
+    keys = [text_key(text) for text in texts]
+    first_text = {}
+    for key, text in zip(keys, texts):
+        first_text.setdefault(key, text)
+    unique = list(first_text)
+    singleflight.record_duplicates(len(keys) - len(unique))
+
+    found = dict(zip(unique, await lookup_vectors(unique)))
+    missing = [key for key in unique if found[key] is None]
+    timings = []
+    if missing:
+        ensure_ready()
+
+        async def compute(owned: list[str]) -> list[np.ndarray]:
+            nonlocal timings
+            encoded, timings = await inference_executor.run(
+                encode_in_batches,
+                [first_text[key] for key in owned],
+                batch_size,
+            )
+            await remember_vectors(owned, encoded)
+            return list(encoded)
+
+        found.update(zip(missing, await singleflight.run(missing, compute)))
+    missing_keys = set(missing)
+    cached = sum(1 for key in keys if key not in missing_keys)
+    return np.vstack([found[key] for key in keys]), cached, timings
+
+@app.post("/embed/batch", response_model=BatchEmbeddingOut)
+async def embed_batch(payload: BatchIn, accept: str | None = Header(default=None)):
+    """Return 384-dim embeddings for a list of texts in one call, encoded per Accept"""
+    started = time.perf_counter()
+    matrix, cached, timings = await embed_many(payload.texts, payload.batch_size or BATCH_SIZE)
+    response = vectors_response(matrix, accept, extra={
+        "ids": payload.ids,
+        "cached": cached,
+        "batches": [timing.model_dump() for timing in timings],
+        "total_ms": (time.perf_counter() - started) * 1000,
+    })
+    if response is not None:
+        return response
+    return BatchEmbeddingOut(
+        ids=payload.ids,
+        embeddings=matrix.tolist(),
+        cached=cached,
+        batches=timings,
+        total_ms=(time.perf_counter() - started) * 1000,
+    )
+
+async def embed_stream_batch(texts: list[str]) -> np.ndarray:
+    matrix, _, _ = await embed_many(texts, BATCH_SIZE)
+    return matrix
+
+# POST /embed/stream: NDJSON in, NDJSON out, one internal batch at a time
+app.add_route("/embed/stream", NdjsonEmbedEndpoint(embed_stream_batch, STREAM_BATCH_SIZE), methods=["POST"])
+
+def corpus_digest(chunks: list[dict]) -> str:
+    """Digest of the model, backend and chunk ids and texts the /search vectors come from."""
+    digest = hashlib.sha256(f"{MODEL_NAME}\0{BACKEND}\0{MODEL_REVISION}".encode())
+    for chunk in chunks:
+        digest.update(f"\0{chunk['chunk_id']}\0{text_key(chunk['text'])}".encode())
+    return digest.hexdigest()
+
+def load_or_build_hnsw(ids: list[str], matrix: np.ndarray, corpus: str) -> HnswIndex:
+    # A saved graph holds its own vectors, so it is reused only for the same corpus and build
+    source = f"{corpus}:m={HNSW_M}:ef_construction={HNSW_EF_CONSTRUCTION}"
+    if HNSW_PATH and os.path.exists(HNSW_PATH):
+        index = HnswIndex.load(HNSW_PATH)
+        if index.source == source and index.ids == ids:
+            index.ef_search = HNSW_EF_SEARCH
+            return index
+        logger.info("Saved HNSW index at %s is stale, rebuilding", HNSW_PATH)
+    index = HnswIndex.build(ids, matrix, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH)
+    index.source = source
+    if HNSW_PATH:
+        index.save(HNSW_PATH)
+    return index
+
+def load_or_build_ivfpq(ids: list[str], matrix: np.ndarray, corpus: str) -> IvfPqIndex:
+    # Codes and raw vectors are reused only for the same corpus and build parameters
+    source = f"{corpus}:nlist={IVFPQ_NLIST}:m={IVFPQ_M}:raw={IVFPQ_RERANK > 0}"
+    if IVFPQ_PATH and os.path.exists(IVFPQ_PATH):
+        index = IvfPqIndex.load(IVFPQ_PATH)
+        if index.source == source and index.ids == ids and (index.raw is not None or not IVFPQ_RERANK):
+            index.nprobe, index.rerank = IVFPQ_NPROBE, IVFPQ_RERANK
+            return index
+        logger.info("Saved IVF-PQ index at %s is stale, rebuilding", IVFPQ_PATH)
+    index = IvfPqIndex.build(
+        ids, matrix, nlist=IVFPQ_NLIST or None, m=IVFPQ_M, nprobe=IVFPQ_NPROBE,
+        rerank=IVFPQ_RERANK, keep_vectors=IVFPQ_RERANK > 0,
+    )
+    index.source = source
+    if IVFPQ_PATH:
+        index.save(IVFPQ_PATH)
+        # Reload so re-ranking reads the memory-mapped copy instead of holding it in RAM,
+        # unless a sibling worker has meanwhile replaced the file with something else
+        saved = IvfPqIndex.load(IVFPQ_PATH)
+        if saved.source == source and saved.ids == ids:
+            index = saved
+    return index
+
+async def sync_chunk_store() -> None:
+    """Mirror the chunk files into the chunk store that hydrates /search and /chunks/fetch."""
+    chunks = await asyncio.to_thread(load_chunks, CHUNK_FILES, True)
+    synced = await asyncio.to_thread(chunk_store.sync, {chunk["chunk_id"]: chunk["payload"] for chunk in chunks})
+    logger.info("Chunk store synced: %d payloads written, %d deleted", synced["written"], synced["deleted"])
+
+async def build_search_index() -> None:
+    """Embed every chunk (mostly store hits after the first start) into the /search matrix."""
+    global search_index, search_bitmaps, bm25_index, search_version
+    chunks = await asyncio.to_thread(load_chunks, SEARCH_CHUNK_FILES)
+    # Rows sorted by company and product make those filters contiguous slices
+    chunks.sort(key=lambda chunk: (chunk["company_id"] or "", chunk["product_id"] or ""))
+    search_bitmaps = MetadataBitmaps(chunks)
+    chunk_texts.update((chunk["chunk_id"], chunk["text"]) for chunk in chunks)
+    bm25_index = await asyncio.to_thread(
+        Bm25Index, [chunk["chunk_id"] for chunk in chunks], [chunk["text"] for chunk in chunks],
+    )
+    matrix, cached, _ = await embed_many([chunk["text"] for chunk in chunks], BATCH_SIZE)
+    ids = [chunk["chunk_id"] for chunk in chunks]
+    corpus = corpus_digest(chunks)
+    if SEARCH_INDEX == "hnsw":
+        search_index = await asyncio.to_thread(load_or_build_hnsw, ids, matrix, corpus)
+    elif SEARCH_INDEX == "ivfpq":
+        search_index = await asyncio.to_thread(load_or_build_ivfpq, ids, matrix, corpus)
+    else:
+        search_index = ExactIndex(ids, matrix)
+    search_version = hashlib.sha256(f"{corpus}\0{SEARCH_INDEX}".encode()).hexdigest()[:16]
+    logger.info("Search index holds %d chunks (%d from cache or store)", len(chunks), cached)
+
+# Search request schema; filters map a metadata field to one value or a list of
+# alternatives, and every field given must match
+class SearchIn(BaseModel):
+    query: str
+    top_k: int = SEARCH_DEFAULT_TOP_K
+    filters: dict[str, str | list[str]] | None = None
+    mode: Literal["dense", "bm25", "hybrid"] = SEARCH_MODE
+    # Diversify the top_k by MMR over a larger candidate pool; lower is more diverse
+    mmr_lambda: float | None = SEARCH_MMR_LAMBDA
+    # Re-rank the top_k candidates with the cross-encoder and return the best top_n
+    rerank: bool = False
+    top_n: int = RERANK_TOP_N
+    # Return each match's chunk payload, projected to fields ("metadata.category") if given
+    include_payload: bool = False
+    fields: list[str] | None = None
+
+    @model_validator(mode="after")
+    def check_search(self):
+        if not 1 <= self.top_k <= SEARCH_MAX_TOP_K:
+            raise ValueError(f"top_k must be between 1 and {SEARCH_MAX_TOP_K}")
+        if self.mmr_lambda is not None and not 0 <= self.mmr_lambda <= 1:
+            raise ValueError("mmr_lambda must be between 0 and 1")
+        if self.rerank and not 1 <= self.top_n <= self.top_k:
+            raise ValueError("top_n must be between 1 and top_k")
+        for field, values in (self.filters or {}).items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"cannot filter on {field!r}; use one of {', '.join(FILTER_FIELDS)}")
+            self.filters[field] = [values] if isinstance(values, str) else values
+        return self
+
+    def cache_signature(self) -> str:
+        """Everything but the query text that changes the matched ids, in a canonical form.
+
+        Payload hydration happens after the cache, so include_payload and fields are
+        left out, and filters are sorted so their order does not split entries.
+        """
+        filters = {field: sorted(values) for field, values in sorted((self.filters or {}).items())}
+        return self.model_copy(update={"filters": filters}).model_dump_json(
+            exclude={"query", "include_payload", "fields"},
+        )
+
+# One search hit; the score is cosine (dense), BM25 (bm25), fused RRF (hybrid) or
+# the cross-encoder score when re-ranked
+class SearchMatch(BaseModel):
+    id: str
+    score: float
+    payload: dict | None = None
+
+# Search response schema, best match first, with the latency of each leg
+class SearchOut(BaseModel):
+    matches: list[SearchMatch]
+    mode: str
+    # Rows that passed the filters, or None for an unfiltered search
+    matched: int | None = None
+    embed_ms: float | None = None
+    search_ms: float | None = None
+    bm25_ms: float | None = None
+    mmr_ms: float | None = None
+    rerank_ms: float | None = None
+    # Re-ranked pairs whose score came from the cache
+    rerank_cached: int | None = None
+    hydrate_ms: float | None = None
+    # "exact" or "semantic" when the matches came from the result cache
+    cache: str | None = None
+    total_ms: float
+
+async def dense_leg(vector: np.ndarray, k: int, rows: np.ndarray | None, timings: dict):
+    started = time.perf_counter()
+    if SEARCH_INDEX == "exact":
+        # One matrix-vector product; cheaper than a hop to a worker thread
+        result = search_index.search(vector, k, rows)
+    else:
+        # HNSW walks its graph in Python and IVF-PQ scans lists, either of which would
+        # stall the event loop and the micro-batcher for milliseconds
+        result = await asyncio.to_thread(search_index.search, vector, k, rows)
+    timings["search_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+async def bm25_leg(query: str, k: int, rows: np.ndarray | None, timings: dict):
+    started = time.perf_counter()
+    result = await asyncio.to_thread(bm25_index.search, query, k, rows)
+    timings["bm25_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+async def search_uncached(payload: SearchIn, rows: np.ndarray | None, vector: np.ndarray | None, depth: int,
+                          bm25_task: asyncio.Future | None, timings: dict) -> tuple[list[str], np.ndarray]:
+    """Retrieve, fuse, diversify and re-rank the matches for one /search request."""
+    if payload.mode == "hybrid":
+        dense_ids, _ = await dense_leg(vector, max(depth, SEARCH_FUSION_DEPTH), rows, timings)
+        bm25_ids, _ = await bm25_task
+        fused = reciprocal_rank_fusion([dense_ids, bm25_ids], SEARCH_RRF_K)[:depth]
+        ids, scores = [chunk_id for chunk_id, _ in fused], np.array([score for _, score in fused])
+    elif payload.mode == "bm25":
+        ids, scores = await bm25_leg(payload.query, depth, rows, timings)
+    else:
+        ids, scores = await dense_leg(vector, depth, rows, timings)
+    if payload.mmr_lambda is not None:
+        diversified = time.perf_counter()
+        picks = mmr_select(scores, search_index.vectors_for(ids), payload.top_k, payload.mmr_lambda)
+        ids, scores = [ids[i] for i in picks], scores[picks]
+        timings["mmr_ms"] = (time.perf_counter() - diversified) * 1000
+    if payload.rerank:
+        reranked = time.perf_counter()
+        ids, scores, timings["rerank_cached"] = await inference_executor.run(
+            reranker.rerank, payload.query, text_key(payload.query), ids, [chunk_texts[i] for i in ids], payload.top_n,
+        )
+        timings["rerank_ms"] = (time.perf_counter() - reranked) * 1000
+    return ids, scores
+
+@app.post("/search", response_model=SearchOut)
+async def search(payload: SearchIn):
+    """Return the top_k chunk ids for a query by dense, BM25 or hybrid (RRF-fused) retrieval, optionally filtered
+
+    Results are cached per request parameters; a repeated query, or in dense mode a
+    near-identical one (by embedding cosine), is answered from the cache while the
+    index version matches.
+    """
+    ensure_ready(("ready",))
+    if search_index is None:
+        return JSONResponse({"detail": "search index is disabled"}, status_code=404)
+    if payload.rerank and reranker is None:
+        return JSONResponse({"detail": "re-ranking is disabled"}, status_code=404)
+    if payload.include_payload and chunk_store is None:
+        return JSONResponse({"detail": "chunk store is disabled"}, status_code=404)
+    started = time.perf_counter()
+    rows = search_bitmaps.rows(payload.filters)
+    timings = {}
+    query_key, signature = text_key(payload.query), payload.cache_signature()
+    version = search_version
+    cached = query_cache.get_exact(query_key, signature, version)
+    if cached is not None:
+        timings["cache"] = "exact"
+    else:
+        # MMR chooses the top_k from a larger pool of candidates
+        depth = payload.top_k if payload.mmr_lambda is None else max(payload.top_k, SEARCH_MMR_POOL)
+        leg_depth = max(depth, SEARCH_FUSION_DEPTH)
+        # BM25 runs on a worker thread while the query is embedded and looked up
+        bm25_task = (asyncio.ensure_future(bm25_leg(payload.query, leg_depth, rows, timings))
+                     if payload.mode == "hybrid" else None)
+        vector = None
+        if payload.mode != "bm25":
+            embedding = time.perf_counter()
+            vector = await embed_one(payload.query)
+            timings["embed_ms"] = (time.perf_counter() - embedding) * 1000
+            # Only pure dense results are reused for a merely similar query: BM25 tells
+            # apart exact terms ("IRA/19/007/2025" vs "IRA/19/008/2025") that the
+            # embeddings do not
+            if payload.mode == "dense":
+                cached = query_cache.get_similar(vector, signature, version)
+        if cached is not None:
+            timings["cache"] = "semantic"
+            if bm25_task is not None:
+                bm25_task.cancel()
+        else:
+            computing = time.perf_counter()
+            cached = await search_uncached(payload, rows, vector, depth, bm25_task, timings)
+            query_cache.put(query_key, signature, version, vector if payload.mode == "dense" else None, cached,
+                            (time.perf_counter() - computing) * 1000)
+    ids, scores = cached
+    # Payloads are read per request, not cached with the ids, so they follow the store
+    payloads = {}
+    if payload.include_payload:
+        hydrating = time.perf_counter()
+        payloads = await asyncio.to_thread(chunk_store.get_many, ids, payload.fields)
+        timings["hydrate_ms"] = (time.perf_counter() - hydrating) * 1000
+    return SearchOut(
+        matches=[
+            SearchMatch(id=chunk_id, score=float(score), payload=payloads.get(chunk_id))
+            for chunk_id, score in zip(ids, scores)
+        ],
+        mode=payload.mode,
+        matched=len(rows) if rows is not None else None,
+        total_ms=(time.perf_counter() - started) * 1000,
+        **timings,
+    )
+
+# Chunk payload request schema
+class ChunksIn(BaseModel):
+    ids: list[str]
+    fields: list[str] | None = None
+
+    @model_validator(mode="after")
+    def check_chunks(self):
+        if not 1 <= len(self.ids) <= CHUNK_FETCH_MAX_IDS:
+            raise ValueError(f"ids must hold between 1 and {CHUNK_FETCH_MAX_IDS} chunk ids")
+        return self
+
+# One stored chunk
+class ChunkOut(BaseModel):
+    id: str
+    payload: dict
+
+# Chunk payload response schema, in request order; unknown ids are listed as missing
+class ChunksOut(BaseModel):
+    chunks: list[ChunkOut]
+    missing: list[str]
+
+@app.post("/chunks/fetch", response_model=ChunksOut)
+async def fetch_chunks(payload: ChunksIn):
+    """Return the stored payloads of chunks by id, optionally projected to some fields"""
+    ensure_ready(("ready",))
+    if chunk_store is None:
+        return JSONResponse({"detail": "chunk store is disabled"}, status_code=404)
+    found = await asyncio.to_thread(chunk_store.get_many, payload.ids, payload.fields)
+    return ChunksOut(
+        chunks=[ChunkOut(id=chunk_id, payload=found[chunk_id]) for chunk_id in payload.ids if chunk_id in found],
+        missing=[chunk_id for chunk_id in payload.ids if chunk_id not in found],
+    )
+
+@app.get("/livez")
+def livez():
+    """Liveness: the process is up and serving HTTP"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: the model is loaded and warmed up and the chunk store and search index are built"""
+    status_code = 200 if startup["phase"] == "ready" else 503
+    # The pid tells pre-fork workers sharing one socket apart
+    return JSONResponse({"status": startup["phase"], "pid": os.getpid(), **startup}, status_code=status_code)
+
+@app.get("/stats")
+def service_stats():
+    """Return startup, executor, batching, padding, coalescing, cache, store and index counters"""
+    return {
+        "startup": startup,
+        "executor": inference_executor.stats(),
+        "batcher": batcher.stats(),
+        "singleflight": singleflight.stats(),
+        "padding": padding.stats(),
+        "cache": cache.stats(),
+        "store": store.stats() if store is not None else None,
+        "search": search_index.stats() if search_index is not None else None,
+        "filters": search_bitmaps.stats() if search_bitmaps is not None else None,
+        "bm25": bm25_index.stats() if bm25_index is not None else None,
+        "rerank": reranker.stats() if reranker is not None else None,
+        "chunks": chunk_store.stats() if chunk_store is not None else None,
+        "query_cache": {"index_version": search_version or None, **query_cache.stats()},
+    }
+
+def collect_component_metrics():
+    """Export counters kept by the executor, batcher, cache, store and startup phase."""
+    executor_stats = inference_executor.stats()
+    cache_stats = cache.stats()
+    flight_stats = singleflight.stats()
+    padding_stats = padding.stats()
+    yield ("embedding_inference_queue_depth", "gauge", "Encode jobs waiting for an inference thread",
+           [({}, executor_stats["queue_depth"])])
+    yield ("embedding_batcher_queued", "gauge", "Single /embed requests waiting for a micro-batch",
+           [({}, batcher.stats()["queued"])])
+    yield ("embedding_rejections_total", "counter", "Requests shed because a queue was full",
+           [({"queue": "inference"}, executor_stats["rejected"]), ({"queue": "batcher"}, batcher.rejected)])
+    yield ("embedding_cache_lookups_total", "counter", "In-process cache lookups by result",
+           [({"result": "hit"}, cache_stats["hits"]), ({"result": "miss"}, cache_stats["misses"])])
+    yield ("embedding_cache_evictions_total", "counter", "In-process cache evictions",
+           [({}, cache_stats["evictions"])])
+    yield ("embedding_cache_hit_ratio", "gauge", "In-process cache hit ratio", [({}, cache_stats["hit_ratio"])])
+    yield ("embedding_cache_bytes", "gauge", "In-process cache memory in use", [({}, cache_stats["bytes_used"])])
+    if store is not None:
+        store_stats = store.stats()
+        yield ("embedding_store_lookups_total", "counter", "Persistent store lookups by result",
+               [({"result": "hit"}, store_stats["hits"]),
+                ({"result": "miss"}, store_stats["reads"] - store_stats["hits"])])
+    yield ("embedding_singleflight_saved_total", "counter", "Encodes avoided by request coalescing",
+           [({"kind": "coalesced"}, flight_stats["coalesced"]),
+            ({"kind": "deduplicated"}, flight_stats["deduplicated"])])
+    if reranker is not None:
+        rerank_cache = reranker.cache.stats()
+        yield ("embedding_rerank_score_lookups_total", "counter", "Re-rank score cache lookups by result",
+               [({"result": "hit"}, rerank_cache["hits"]), ({"result": "miss"}, rerank_cache["misses"])])
+    query_stats = query_cache.stats()
+    yield ("embedding_query_cache_lookups_total", "counter", "/search result cache lookups by result",
+           [({"result": "exact_hit"}, query_stats["exact_hits"]),
+            ({"result": "semantic_hit"}, query_stats["semantic_hits"]),
+            ({"result": "miss"}, query_stats["misses"])])
+    yield ("embedding_query_cache_hit_ratio", "gauge", "/search result cache hit ratio",
+           [({}, query_stats["hit_ratio"])])
+    yield ("embedding_query_cache_saved_seconds_total", "counter",
+           "Retrieval time avoided by serving cached /search results", [({}, query_stats["saved_ms"] / 1000)])
+    yield ("embedding_tokens_total", "counter", "Tokens encoded, real vs padded",
+           [({"kind": "real"}, padding_stats["real_tokens"]), ({"kind": "padded"}, padding_stats["padded_tokens"])])
+    yield ("embedding_padding_efficiency", "gauge", "Real tokens divided by padded tokens",
+           [({}, padding_stats["padding_efficiency"])])
+    yield ("embedding_model_ready", "gauge", "1 once the model is warmed up and the search index built",
+           [({}, int(startup["phase"] == "ready"))])
+    for key, name, documentation in (
+        ("load_s", "embedding_model_load_seconds", "Time to load the model"),
+        ("warmup_s", "embedding_model_warmup_seconds", "Time spent in warm-up batches"),
+        ("index_s", "embedding_search_index_build_seconds",
+         "Time to sync the chunk store and embed the chunk corpus for /search"),
+        ("ready_s", "embedding_import_to_ready_seconds", "Time from import to ready"),
+    ):
+        if startup[key] is not None:
+            yield (name, "gauge", documentation, [({}, startup[key])])
+
+metrics.register_collector(collect_component_metrics)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Return metrics in the Prometheus text format"""
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
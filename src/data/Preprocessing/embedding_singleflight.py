@@ -0,0 +1,69 @@
+import asyncio
+from typing import Awaitable, Callable
+
+
+class SingleFlight:
+    """Deduplicate identical in-flight computations by key.
+
+    ``run`` computes each key at most once across concurrent callers: keys already
+    being computed by another request are awaited, and the remaining keys are
+    computed together with a single ``compute(keys)`` call. The computation runs in
+    its own task, so a caller that disconnects does not cancel work other callers
+    are waiting on.
+    """
+
+    def __init__(self):
+        self.computed = 0
+        self.coalesced = 0
+        self.deduplicated = 0
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def run(self, keys: list[str], compute: Callable[[list[str]], Awaitable[list]]) -> list:
+        """Return one result per unique key, in the order given."""
+        loop = asyncio.get_running_loop()
+        futures = {}
+        owned = []
+        for key in keys:
+            if key in futures:
+                continue
+            future = self._inflight.get(key)
+            if future is None:
+                future = loop.create_future()
+                self._inflight[key] = future
+                owned.append(key)
+            else:
+                self.coalesced += 1
+            futures[key] = future
+
+        if owned:
+            self.computed += len(owned)
+            task = asyncio.ensure_future(compute(owned))
+            task.add_done_callback(lambda done: self._settle(owned, done))
+        return [await asyncio.shield(futures[key]) for key in dict.fromkeys(keys)]
+
+    def _settle(self, owned: list[str], task: asyncio.Task) -> None:
+        error = None if task.cancelled() else task.exception()
+        results = task.result() if not task.cancelled() and error is None else None
+        for i, key in enumerate(owned):
+            future = self._inflight.pop(key)
+            if task.cancelled():
+                future.cancel()
+            elif error is not None:
+                future.set_exception(error)
+                # Mark retrieved: waiters that already left must not log it again
+                future.exception()
+            else:
+                future.set_result(results[i])
+
+    def record_duplicates(self, count: int) -> None:
+        """Count repeated texts collapsed inside one request."""
+        self.deduplicated += count
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "computed": self.computed,
+            "coalesced": self.coalesced,
+            "deduplicated": self.deduplicated,
+            "saved": self.coalesced + self.deduplicated,
+        }
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# SQLite caps the number of bound parameters per statement
+SELECT_CHUNK = 500
+
+
+class SqliteConnections:
+    """Per-thread connections to one SQLite file in WAL mode, shared by the stores.
+
+    Each thread gets its own connection, reopened after a fork, so any number of
+    processes can read while one writes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run the block in one write transaction, rolled back if it raises."""
+        conn = self.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
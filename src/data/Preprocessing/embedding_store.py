@@ -0,0 +1,91 @@
+import time
+
+import numpy as np
+
+from embedding_sqlite import SELECT_CHUNK, SqliteConnections
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (model, revision, text_hash)
+) WITHOUT ROWID
+"""
+
+
+class EmbeddingStore:
+    """Content-addressed embedding store on SQLite, shared by worker processes.
+
+    Rows are keyed by (model name, model revision, text hash) and hold raw
+    little-endian float32 vectors. The database runs in WAL mode so any number
+    of processes can read while one writes; inserts are idempotent, so workers
+    racing on the same text simply keep the first vector written.
+    """
+
+    def __init__(self, path: str, model: str, revision: str):
+        self.path = path
+        self.model = model
+        self.revision = revision
+        self.reads = 0
+        self.hits = 0
+        self.writes = 0
+        self._connections = SqliteConnections(path)
+        self._connections.get().execute(_SCHEMA)
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """Return the stored vectors for whichever keys are present."""
+        conn = self._connections.get()
+        found = {}
+        for start in range(0, len(keys), SELECT_CHUNK):
+            chunk = keys[start:start + SELECT_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings "
+                f"WHERE model = ? AND revision = ? AND text_hash IN ({placeholders})",
+                (self.model, self.revision, *chunk),
+            )
+            for text_hash, blob in rows:
+                found[text_hash] = np.frombuffer(blob, dtype="<f4")
+        self.reads += len(keys)
+        self.hits += len(found)
+        return found
+
+    def put_many(self, items: list[tuple[str, np.ndarray]]) -> None:
+        """Insert vectors for keys that are not stored yet."""
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (self.model, self.revision, key, int(vector.shape[-1]),
+             np.asarray(vector, dtype="<f4").tobytes(), now)
+            for key, vector in items
+        ]
+        with self._connections.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO embeddings "
+                "(model, revision, text_hash, dim, vector, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        self.writes += len(rows)
+
+    def count(self) -> int:
+        (total,) = self._connections.get().execute(
+            "SELECT COUNT(*) FROM embeddings WHERE model = ? AND revision = ?",
+            (self.model, self.revision),
+        ).fetchone()
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "model": self.model,
+            "revision": self.revision,
+            "reads": self.reads,
+            "hits": self.hits,
+            "writes": self.writes,
+            "hit_ratio": self.hits / self.reads if self.reads else 0.0,
+        }
@@ -0,0 +1,138 @@
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+import numpy as np
+
+from embedding_executor import Overloaded
+
+NDJSON = "application/x-ndjson"
+
+
+class NdjsonEmbedEndpoint:
+    """Raw ASGI endpoint that embeds an NDJSON request body as it streams in.
+
+    Each request line is ``{"id": ..., "text": ...}`` (``id`` defaults to the line
+    number). Lines are collected into batches of ``batch_size``; every finished
+    batch is written back immediately as NDJSON ``{"id": ..., "embedding": [...]}``
+    lines in input order.
+
+    The body is only read while the previous batch's output has been handed to the
+    server, and ``send`` waits while the client is not draining the response. A
+    slow reader therefore stops the server from reading more input (and TCP pushes
+    back on the producer), so memory on both sides stays bounded by one batch plus
+    one partial line.
+
+    If the inference queue is full before any output was sent the request is
+    shed with 503 + Retry-After; once streaming has started, the batch is retried
+    after the suggested delay instead, which throttles the producer further.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[list[str]], Awaitable[np.ndarray]],
+        batch_size: int,
+        max_line_bytes: int = 1024 * 1024,
+    ):
+        self.embed_fn = embed_fn
+        self.batch_size = batch_size
+        self.max_line_bytes = max_line_bytes
+
+    async def __call__(self, scope, receive, send) -> None:
+        stream = _Stream(send)
+        pending = b""
+        batch: list[tuple[object, str]] = []
+        line_number = 0
+        more_body = True
+        try:
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                pending += message.get("body", b"")
+                more_body = message.get("more_body", False)
+                *lines, pending = pending.split(b"\n")
+                if not more_body:
+                    lines.append(pending)
+                    pending = b""
+                if len(pending) > self.max_line_bytes:
+                    raise ValueError(f"line {line_number + len(lines) + 1} exceeds {self.max_line_bytes} bytes")
+                for line in lines:
+                    line_number += 1
+                    if not line.strip():
+                        continue
+                    batch.append(_parse_line(line, line_number))
+                    if len(batch) >= self.batch_size:
+                        await self._flush(batch, stream)
+                        batch = []
+            if batch:
+                await self._flush(batch, stream)
+        except ValueError as exc:
+            await stream.error(str(exc))
+            return
+        except Overloaded as exc:
+            await stream.error(str(exc), status=503, headers=[(b"retry-after", str(exc.retry_after).encode())])
+            return
+        await stream.finish()
+
+    async def _flush(self, batch: list[tuple[object, str]], stream: "_Stream") -> None:
+        texts = [text for _, text in batch]
+        while True:
+            try:
+                vectors = await self.embed_fn(texts)
+                break
+            except Overloaded as exc:
+                if not stream.started:
+                    raise
+                await asyncio.sleep(exc.retry_after)
+        body = "".join(
+            json.dumps({"id": item_id, "embedding": vector.tolist()}) + "\n"
+            for (item_id, _), vector in zip(batch, vectors)
+        )
+        await stream.write(body.encode("utf-8"))
+
+
+class _Stream:
+    """Lazily starts the response so errors before the first batch get a real status."""
+
+    def __init__(self, send):
+        self.send = send
+        self.started = False
+
+    async def write(self, body: bytes) -> None:
+        if not self.started:
+            await self.send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", NDJSON.encode())],
+            })
+            self.started = True
+        await self.send({"type": "http.response.body", "body": body, "more_body": True})
+
+    async def finish(self) -> None:
+        if not self.started:
+            await self.write(b"")
+        await self.send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def error(self, detail: str, status: int = 400, headers: list | None = None) -> None:
+        body = (json.dumps({"error": detail}) + "\n").encode("utf-8")
+        if self.started:
+            # Headers are gone; report in-band and end the stream
+            await self.send({"type": "http.response.body", "body": body, "more_body": False})
+            return
+        await self.send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", NDJSON.encode()), *(headers or [])],
+        })
+        await self.send({"type": "http.response.body", "body": body, "more_body": False})
+
+
+def _parse_line(line: bytes, line_number: int) -> tuple[object, str]:
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"line {line_number} is not valid JSON: {exc.msg}") from None
+    if not isinstance(item, dict) or not isinstance(item.get("text"), str):
+        raise ValueError(f"line {line_number} must be an object with a string 'text'")
+    return item.get("id", line_number), item["text"]
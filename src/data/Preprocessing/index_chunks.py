@@ -0,0 +1,226 @@
+"""Embed the chunk files and upsert them into a Pinecone-compatible index.
+
+Chunks are read from the chunk files (by default the processed product chunks and
+the preprocessed company chunks), cut into batches and embedded either in-process
+with the local model or through the embedding service's /embed/batch. Each batch
+is then upserted with the chunk id as vector id and the chunk's filterable
+metadata, so re-running the command overwrites vectors instead of duplicating them.
+
+Embedding and upserting overlap: while the next batch is embedded, up to
+--concurrency upserts are in flight. Requests that fail with 429, 5xx or a
+connection error are retried with exponential backoff and jitter, honouring
+Retry-After. After each upserted batch its content digest is written to the
+checkpoint file, so a crashed or interrupted run resumes where it stopped and an
+unchanged corpus is skipped entirely; a batch whose chunks changed is re-sent.
+
+    python index_chunks.py --host http://localhost:5081
+    python index_chunks.py --host https://<index-host> --embed service --service-url http://localhost:8000
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from embedding_cache import text_key
+from embedding_search import DEFAULT_CHUNK_FILES, load_chunks
+
+# Metadata stored with each vector; Pinecone rejects null values, so empty fields are left out
+METADATA_FIELDS = ("company_id", "product_id", "chunk_type", "category")
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RequestFailed(Exception):
+    pass
+
+
+def post_json(url: str, payload: dict, headers: dict, retries: int, backoff_s: float, timeout: float = 60) -> dict:
+    """POST JSON and return the decoded response, retrying transient failures."""
+    body = json.dumps(payload).encode()
+    for attempt in range(retries + 1):
+        request = urllib.request.Request(
+            url, data=body, method="POST", headers={"Content-Type": "application/json", **headers},
+        )
+        retry_after = None
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as exc:
+            if exc.code not in RETRY_STATUSES:
+                raise RequestFailed(f"{url}: {exc.code} {exc.read()[:500]!r}") from exc
+            error = f"{exc.code} {exc.reason}"
+            retry_after = exc.headers.get("Retry-After")
+        except (urllib.error.URLError, ConnectionError, TimeoutError) as exc:
+            error = str(exc)
+        if attempt == retries:
+            raise RequestFailed(f"{url}: {error} after {retries + 1} attempts")
+        delay = backoff_s * 2 ** attempt * random.uniform(0.5, 1.0)
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        time.sleep(delay)
+
+
+def batch_digest(chunks: list[dict], scope: str) -> str:
+    """Content digest of a batch: ids, texts and metadata, plus model and target index."""
+    digest = hashlib.sha256(scope.encode())
+    for chunk in chunks:
+        digest.update(f"\0{chunk['chunk_id']}\0{text_key(chunk['text'])}".encode())
+        digest.update(json.dumps(vector_metadata(chunk), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def vector_metadata(chunk: dict) -> dict:
+    return {field: chunk[field] for field in METADATA_FIELDS if chunk.get(field)}
+
+
+class Checkpoint:
+    """Digests of the batches already upserted, rewritten atomically after each one."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: set[str] = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.done = set(json.load(f)["done"])
+
+    def add(self, digest: str) -> None:
+        with self._lock:
+            self.done.add(digest)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"done": sorted(self.done)}, f)
+            os.replace(self.path + ".tmp", self.path)
+
+
+class LocalEmbedder:
+    def __init__(self, backend_name: str, model_name: str, revision: str | None):
+        from embedding_backends import load_backend
+
+        self.backend = load_backend(backend_name, model_name, revision)
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        return self.backend.encode(texts)
+
+
+class ServiceEmbedder:
+    def __init__(self, url: str, retries: int, backoff_s: float):
+        self.url = url.rstrip("/") + "/embed/batch"
+        self.retries = retries
+        self.backoff_s = backoff_s
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        response = post_json(self.url, {"texts": texts}, {}, self.retries, self.backoff_s, timeout=300)
+        return np.asarray(response["embeddings"], dtype=np.float32)
+
+
+def index_chunks(chunks: list[dict], embed, host: str, api_key: str, namespace: str, checkpoint: Checkpoint,
+                 scope: str, batch_size: int, concurrency: int, retries: int, backoff_s: float) -> dict:
+    """Embed and upsert every batch not in the checkpoint; return counts and timings."""
+    url = host.rstrip("/") + "/vectors/upsert"
+    headers = {"Api-Key": api_key, "X-Pinecone-API-Version": "2025-04"}
+    stats = {"chunks": len(chunks), "batches": 0, "skipped": 0, "upserted": 0, "embed_s": 0.0}
+    slots = threading.BoundedSemaphore(concurrency)
+    lock = threading.Lock()
+    failures = []
+
+    def upsert(batch: list[dict], vectors: np.ndarray, digest: str) -> None:
+        try:
+            payload = {
+                "namespace": namespace,
+                "vectors": [
+                    {"id": chunk["chunk_id"], "values": vector.tolist(), "metadata": vector_metadata(chunk)}
+                    for chunk, vector in zip(batch, vectors)
+                ],
+            }
+            post_json(url, payload, headers, retries, backoff_s)
+            checkpoint.add(digest)
+            with lock:
+                stats["upserted"] += len(batch)
+        except Exception as exc:
+            with lock:
+                failures.append(exc)
+        finally:
+            slots.release()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            digest = batch_digest(batch, scope)
+            stats["batches"] += 1
+            if digest in checkpoint.done:
+                stats["skipped"] += len(batch)
+                continue
+            embedding = time.perf_counter()
+            vectors = embed([chunk["text"] for chunk in batch])
+            stats["embed_s"] += time.perf_counter() - embedding
+            # Blocks while `concurrency` upserts are in flight
+            slots.acquire()
+            if failures:
+                slots.release()
+                break
+            pool.submit(upsert, batch, vectors, digest)
+    stats["wall_s"] = time.perf_counter() - started
+    stats["vectors_per_s"] = stats["upserted"] / stats["wall_s"] if stats["wall_s"] else 0.0
+    if failures:
+        raise RequestFailed(f"{len(failures)} batch(es) failed, first: {failures[0]}; "
+                            f"{stats['upserted']} vectors upserted, rerun to resume")
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", nargs="+", default=list(DEFAULT_CHUNK_FILES), help="chunk files to index")
+    parser.add_argument("--host", default=os.environ.get("PINECONE_HOST"), help="index host (default PINECONE_HOST)")
+    parser.add_argument("--namespace", default="")
+    parser.add_argument("--embed", choices=("local", "service"), default="local")
+    parser.add_argument("--service-url", default=os.environ.get("EMBEDDING_SERVICE_URL", "http://localhost:8000"))
+    parser.add_argument("--model", default=os.environ.get("EMBED_MODEL_NAME", "all-MiniLM-L6-v2"))
+    parser.add_argument("--revision", default=os.environ.get("EMBED_MODEL_REVISION") or None)
+    parser.add_argument("--backend", default=os.environ.get("EMBED_BACKEND", "torch-fp32"))
+    parser.add_argument("--batch-size", type=int, default=100, help="vectors per embed and upsert batch")
+    parser.add_argument("--concurrency", type=int, default=4, help="upserts in flight")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--backoff", type=float, default=0.5, help="first retry delay in seconds")
+    parser.add_argument("--checkpoint", default="index_chunks.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore and overwrite the checkpoint")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+    if not args.host:
+        parser.error("--host or PINECONE_HOST is required")
+
+    chunks = load_chunks(args.files)
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.embed == "service":
+        embed = ServiceEmbedder(args.service_url, args.retries, args.backoff)
+        model = f"service:{args.service_url}"
+    else:
+        embed = LocalEmbedder(args.backend, args.model, args.revision)
+        model = f"{args.model}:{args.backend}:{args.revision or 'main'}"
+    try:
+        stats = index_chunks(
+            chunks, embed, args.host, os.environ.get("PINECONE_API_KEY", ""), args.namespace, checkpoint,
+            f"{model}\0{args.host}\0{args.namespace}", args.batch_size, args.concurrency, args.retries, args.backoff,
+        )
+    except RequestFailed as exc:
+        raise SystemExit(str(exc))
+    print(f"{stats['upserted']} vectors upserted, {stats['skipped']} unchanged skipped, "
+          f"{stats['batches']} batches in {stats['wall_s']:.1f}s "
+          f"(embedding {stats['embed_s']:.1f}s): {stats['vectors_per_s']:.0f} vectors/s")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+"""Local stand-in for a Pinecone serverless index.
+
+Serves the subset of the Pinecone data-plane REST API the app and the indexing
+scripts use: upsert, query (topK, filter, includeValues, includeMetadata, by vector
+or by id), fetch, delete (ids, deleteAll or filter) and describe_index_stats. Each
+namespace is a float32 NumPy matrix plus ids and metadata, persisted under
+PINECONE_LOCAL_PATH as ``ns-<namespace>.npy`` / ``ns-<namespace>.json`` and reloaded
+on start; writes are flushed in the background, at most every PINECONE_LOCAL_FLUSH_S.
+
+Point a client at it by giving the index host explicitly, e.g. in route.ts
+``PINECONE_HOST=http://localhost:5081``; the API key is accepted but not checked.
+
+    python pinecone_local.py --port 5081
+"""
+import argparse
+import json
+import os
+import threading
+from contextlib import asynccontextmanager
+from urllib.parse import quote, unquote
+
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse
+import numpy as np
+from pydantic import BaseModel
+import uvicorn
+
+from embedding_search import top_k
+
+# Directory the namespaces are persisted to
+PINECONE_LOCAL_PATH = os.environ.get("PINECONE_LOCAL_PATH", "pinecone_local")
+# Index dimension; 0 takes it from the first upsert
+PINECONE_LOCAL_DIMENSION = int(os.environ.get("PINECONE_LOCAL_DIMENSION", "0"))
+# Similarity metric: "cosine", "dotproduct" or "euclidean"
+PINECONE_LOCAL_METRIC = os.environ.get("PINECONE_LOCAL_METRIC", "cosine")
+# Seconds between background flushes of changed namespaces to disk
+PINECONE_LOCAL_FLUSH_S = float(os.environ.get("PINECONE_LOCAL_FLUSH_S", "1.0"))
+
+# Pinecone's per-request limits
+MAX_UPSERT = 1000
+MAX_TOP_K = 10000
+
+
+class PineconeError(Exception):
+    """A request error, returned in Pinecone's ``{"code", "message"}`` shape."""
+
+    def __init__(self, message: str, status_code: int = 400, code: int = 3):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+def _compare(value, operator: str, operand) -> bool:
+    if operator == "$eq":
+        return value == operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if operator == "$exists":
+        return (value is not None) == bool(operand)
+    if value is None:
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    if operator == "$lte":
+        return value <= operand
+    raise PineconeError(f"unsupported filter operator {operator}")
+
+
+def matches_filter(metadata: dict | None, flt: dict) -> bool:
+    """Evaluate a Pinecone metadata filter; list-valued fields match if any element does."""
+    metadata = metadata or {}
+    for key, condition in flt.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, part) for part in condition):
+                return False
+        else:
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if isinstance(value, list) and operator in ("$eq", "$in"):
+                    ok = any(_compare(item, operator, operand) for item in value)
+                elif isinstance(value, list) and operator in ("$ne", "$nin"):
+                    ok = all(_compare(item, operator, operand) for item in value)
+                else:
+                    ok = _compare(value, operator, operand)
+                if not ok:
+                    return False
+    return True
+
+
+class Namespace:
+    """Vectors, ids and metadata of one namespace, in a matrix grown by doubling.
+
+    Deleting a vector moves the last row into its place, so the first ``len``
+    rows are always live and a query is one matrix-vector product over them.
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.ids: list[str] = []
+        self.metadata: list[dict | None] = []
+        self.rows: dict[str, int] = {}
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:len(self.ids)]
+
+    def upsert(self, ids: list[str], vectors: np.ndarray, metadata: list[dict | None]) -> None:
+        needed = len(self.ids) + sum(1 for vector_id in set(ids) if vector_id not in self.rows)
+        if needed > len(self._vectors):
+            capacity = max(needed, 2 * len(self._vectors), 1024)
+            grown = np.zeros((capacity, self.dimension), dtype=np.float32)
+            grown[:len(self.ids)] = self.vectors
+            self._vectors = grown
+            self._norms = np.resize(self._norms, capacity)
+        for vector_id, vector, meta in zip(ids, vectors, metadata):
+            row = self.rows.get(vector_id)
+            if row is None:
+                row = self.rows[vector_id] = len(self.ids)
+                self.ids.append(vector_id)
+                self.metadata.append(meta)
+            else:
+                self.metadata[row] = meta
+            self._vectors[row] = vector
+        rows = [self.rows[vector_id] for vector_id in ids]
+        self._norms[rows] = np.linalg.norm(self._vectors[rows], axis=1)
+
+    def delete(self, ids) -> int:
+        deleted = 0
+        for vector_id in ids:
+            row = self.rows.pop(vector_id, None)
+            if row is None:
+                continue
+            last = len(self.ids) - 1
+            if row != last:
+                moved = self.ids[last]
+                self.ids[row], self.metadata[row] = moved, self.metadata[last]
+                self._vectors[row], self._norms[row] = self._vectors[last], self._norms[last]
+                self.rows[moved] = row
+            self.ids.pop()
+            self.metadata.pop()
+            deleted += 1
+        return deleted
+
+    def filter_rows(self, flt: dict | None) -> np.ndarray | None:
+        if not flt:
+            return None
+        return np.array([row for row, meta in enumerate(self.metadata) if matches_filter(meta, flt)],
+                        dtype=np.int64)
+
+    def scores(self, query: np.ndarray, metric: str, rows: np.ndarray | None = None) -> np.ndarray:
+        vectors = self.vectors if rows is None else self._vectors[rows]
+        if metric == "euclidean":
+            # Pinecone reports the squared distance; lower is better
+            return ((vectors - query) ** 2).sum(axis=1)
+        scores = vectors @ query
+        if metric == "cosine":
+            norms = self._norms[:len(self.ids)] if rows is None else self._norms[rows]
+            scores /= np.maximum(norms * np.linalg.norm(query), 1e-12)
+        return scores
+
+    def save(self, directory: str, name: str) -> None:
+        base = os.path.join(directory, "ns-" + quote(name, safe=""))
+        with open(base + ".npy.tmp", "wb") as f:
+            np.save(f, self.vectors)
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump({"dimension": self.dimension, "ids": self.ids, "metadata": self.metadata}, f)
+        os.replace(base + ".npy.tmp", base + ".npy")
+        os.replace(base + ".json.tmp", base + ".json")
+
+    @classmethod
+    def load(cls, base: str) -> "Namespace":
+        with open(base + ".json", encoding="utf-8") as f:
+            saved = json.load(f)
+        namespace = cls(saved["dimension"])
+        vectors = np.load(base + ".npy")
+        if len(saved["ids"]):
+            namespace.upsert(saved["ids"], vectors, saved["metadata"])
+        return namespace
+
+    @staticmethod
+    def remove(directory: str, name: str) -> None:
+        base = os.path.join(directory, "ns-" + quote(name, safe=""))
+        for suffix in (".npy", ".json"):
+            if os.path.exists(base + suffix):
+                os.remove(base + suffix)
+
+
+class LocalIndex:
+    """All namespaces of the index, guarded by one lock and flushed to ``path`` when changed."""
+
+    def __init__(self, path: str, dimension: int = 0, metric: str = "cosine"):
+        if metric not in ("cosine", "dotproduct", "euclidean"):
+            raise ValueError(f"unknown metric {metric!r}")
+        self.path = path
+        self.dimension = dimension
+        self.metric = metric
+        self.namespaces: dict[str, Namespace] = {}
+        self._dirty: set[str] = set()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        for filename in sorted(os.listdir(path)):
+            if filename.startswith("ns-") and filename.endswith(".json"):
+                name = unquote(filename[3:-5])
+                namespace = Namespace.load(os.path.join(path, filename[:-5]))
+                self.namespaces[name] = namespace
+                self.dimension = self.dimension or namespace.dimension
+
+    def _namespace(self, name: str) -> Namespace:
+        namespace = self.namespaces.get(name)
+        if namespace is None:
+            raise PineconeError(f"namespace {name!r} not found", status_code=404, code=5)
+        return namespace
+
+    def _vectors(self, values: list[list[float]]) -> np.ndarray:
+        vectors = np.asarray(values, dtype=np.float32)
+        if vectors.ndim != 2:
+            raise PineconeError("vectors must all have the same dimension")
+        if not self.dimension:
+            self.dimension = vectors.shape[1]
+        if vectors.shape[1] != self.dimension:
+            raise PineconeError(
+                f"Vector dimension {vectors.shape[1]} does not match the dimension of the index {self.dimension}")
+        return vectors
+
+    def upsert(self, name: str, ids: list[str], values: list[list[float]], metadata: list[dict | None]) -> int:
+        with self._lock:
+            vectors = self._vectors(values)
+            namespace = self.namespaces.get(name)
+            if namespace is None:
+                namespace = self.namespaces[name] = Namespace(self.dimension)
+            namespace.upsert(ids, vectors, metadata)
+            self._dirty.add(name)
+        return len(ids)
+
+    def query(self, name: str, k: int, vector: list[float] | None, vector_id: str | None,
+              flt: dict | None, include_values: bool, include_metadata: bool) -> list[dict]:
+        with self._lock:
+            namespace = self.namespaces.get(name)
+            if namespace is None or not len(namespace):
+                return []
+            if vector_id is not None:
+                row = namespace.rows.get(vector_id)
+                if row is None:
+                    return []
+                query = namespace.vectors[row].copy()
+            else:
+                query = self._vectors([vector])[0]
+            rows = namespace.filter_rows(flt)
+            scores = namespace.scores(query, self.metric, rows)
+            best = top_k(-scores if self.metric == "euclidean" else scores, k)
+            matches = []
+            for i in best:
+                row = int(i if rows is None else rows[i])
+                match = {"id": namespace.ids[row], "score": float(scores[i])}
+                if include_values:
+                    match["values"] = namespace.vectors[row].tolist()
+                if include_metadata and namespace.metadata[row] is not None:
+                    match["metadata"] = namespace.metadata[row]
+                matches.append(match)
+            return matches
+
+    def fetch(self, name: str, ids: list[str]) -> dict:
+        with self._lock:
+            namespace = self.namespaces.get(name)
+            found = {}
+            for vector_id in ids:
+                row = namespace.rows.get(vector_id) if namespace is not None else None
+                if row is None:
+                    continue
+                found[vector_id] = {"id": vector_id, "values": namespace.vectors[row].tolist()}
+                if namespace.metadata[row] is not None:
+                    found[vector_id]["metadata"] = namespace.metadata[row]
+            return found
+
+    def delete(self, name: str, ids: list[str] | None, delete_all: bool, flt: dict | None) -> int:
+        with self._lock:
+            if delete_all:
+                namespace = self.namespaces.pop(name, None)
+                Namespace.remove(self.path, name)
+                self._dirty.discard(name)
+                return len(namespace) if namespace is not None else 0
+            namespace = self._namespace(name)
+            if flt:
+                ids = [namespace.ids[row] for row in namespace.filter_rows(flt)]
+            deleted = namespace.delete(ids or [])
+            self._dirty.add(name)
+            return deleted
+
+    def describe(self, flt: dict | None = None) -> dict:
+        with self._lock:
+            counts = {
+                name: len(namespace) if not flt else len(namespace.filter_rows(flt))
+                for name, namespace in self.namespaces.items()
+            }
+        return {
+            "namespaces": {name: {"vectorCount": count} for name, count in counts.items()},
+            "dimension": self.dimension,
+            "indexFullness": 0.0,
+            "totalVectorCount": sum(counts.values()),
+        }
+
+    def flush(self) -> None:
+        """Write every namespace changed since the last flush."""
+        with self._lock:
+            for name in sorted(self._dirty):
+                if name in self.namespaces:
+                    self.namespaces[name].save(self.path, name)
+            self._dirty.clear()
+
+
+index = LocalIndex(PINECONE_LOCAL_PATH, PINECONE_LOCAL_DIMENSION, PINECONE_LOCAL_METRIC)
+_stop_flushing = threading.Event()
+
+
+def flush_periodically() -> None:
+    while not _stop_flushing.wait(PINECONE_LOCAL_FLUSH_S):
+        index.flush()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    flusher = threading.Thread(target=flush_periodically, name="pinecone-local-flush", daemon=True)
+    flusher.start()
+    yield
+    _stop_flushing.set()
+    flusher.join()
+    index.flush()
+
+
+app = FastAPI(title="Pinecone Local", lifespan=lifespan)
+
+
+@app.exception_handler(PineconeError)
+async def pinecone_error_handler(request: Request, exc: PineconeError):
+    return JSONResponse({"code": exc.code, "message": str(exc), "details": []}, status_code=exc.status_code)
+
+
+class Vector(BaseModel):
+    id: str
+    values: list[float]
+    metadata: dict | None = None
+
+
+class UpsertIn(BaseModel):
+    vectors: list[Vector]
+    namespace: str = ""
+
+
+class QueryIn(BaseModel):
+    topK: int
+    vector: list[float] | None = None
+    id: str | None = None
+    namespace: str = ""
+    filter: dict | None = None
+    includeValues: bool = False
+    includeMetadata: bool = False
+
+
+class DeleteIn(BaseModel):
+    ids: list[str] | None = None
+    deleteAll: bool = False
+    namespace: str = ""
+    filter: dict | None = None
+
+
+class StatsIn(BaseModel):
+    filter: dict | None = None
+
+
+@app.post("/vectors/upsert")
+def upsert(payload: UpsertIn):
+    """Insert or overwrite vectors by id"""
+    if not payload.vectors or len(payload.vectors) > MAX_UPSERT:
+        raise PineconeError(f"upsert between 1 and {MAX_UPSERT} vectors per request")
+    count = index.upsert(
+        payload.namespace,
+        [vector.id for vector in payload.vectors],
+        [vector.values for vector in payload.vectors],
+        [vector.metadata for vector in payload.vectors],
+    )
+    return {"upsertedCount": count}
+
+
+@app.post("/query")
+def query(payload: QueryIn):
+    """Return the topK nearest vectors to a vector, or to the stored vector with the given id"""
+    if not 1 <= payload.topK <= MAX_TOP_K:
+        raise PineconeError(f"topK must be between 1 and {MAX_TOP_K}")
+    if (payload.vector is None) == (payload.id is None):
+        raise PineconeError("exactly one of vector or id must be given")
+    matches = index.query(
+        payload.namespace, payload.topK, payload.vector, payload.id,
+        payload.filter, payload.includeValues, payload.includeMetadata,
+    )
+    return {"matches": matches, "namespace": payload.namespace, "usage": {"readUnits": 1}}
+
+
+@app.get("/vectors/fetch")
+def fetch(ids: list[str] = Query(), namespace: str = ""):
+    """Return the stored vectors and metadata for the given ids"""
+    return {"vectors": index.fetch(namespace, ids), "namespace": namespace, "usage": {"readUnits": 1}}
+
+
+@app.post("/vectors/delete")
+def delete(payload: DeleteIn):
+    """Delete vectors by id or by metadata filter, or a whole namespace"""
+    if not payload.deleteAll and not payload.ids and not payload.filter:
+        raise PineconeError("one of ids, deleteAll or filter must be given")
+    index.delete(payload.namespace, payload.ids, payload.deleteAll, payload.filter)
+    return {}
+
+
+@app.get("/describe_index_stats")
+def describe_index_stats():
+    """Vector counts per namespace and the index dimension"""
+    return index.describe()
+
+
+@app.post("/describe_index_stats")
+def describe_index_stats_filtered(payload: StatsIn | None = None):
+    """Vector counts per namespace, optionally only of vectors matching a filter"""
+    return index.describe(payload.filter if payload is not None else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5081)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,283 @@
+"""Pre-fork server for the embedding service.
+
+The parent process imports ``embedding_service`` and loads the model, freezes
+the garbage collector so the loaded objects are never written to again, binds the
+listening socket and forks N workers. The workers share the model weights
+copy-on-write and accept from the same socket. Each worker is pinned to its own
+slice of CPUs and runs the model with a fixed thread count, so N workers x T
+threads never oversubscribe the machine.
+
+No inference runs in the parent before forking: torch and ONNX Runtime thread
+pools do not survive fork, so each worker starts its own and runs the warm-up
+batches itself before its /readyz turns green.
+
+Each worker also builds its own /search index. An HNSW graph is too slow to
+build in every worker, so ``EMBED_SEARCH_INDEX=hnsw`` requires
+``EMBED_HNSW_PATH``: build it once with a single worker, then start the pool,
+whose workers load the saved graph.
+
+    EMBED_SEARCH_INDEX=hnsw EMBED_HNSW_PATH=hnsw.npz python serve_prefork.py serve --workers 1
+    python serve_prefork.py serve --workers 4 --threads 2
+    python serve_prefork.py bench --max-workers 8
+"""
+import argparse
+import gc
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def available_cpus() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(index: int, sock: socket.socket, threads: int, cpus: list[int]) -> None:
+    """Body of a forked worker: pin CPUs, size thread pools, then serve."""
+    import uvicorn
+
+    import embedding_service
+
+    worker_cpus = cpus[index * threads:(index + 1) * threads] or cpus
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, worker_cpus)
+    embedding_service.backend.set_num_threads(threads)
+
+    config = uvicorn.Config(embedding_service.app, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def serve(host: str, port: int, workers: int, threads: int | None) -> None:
+    cpus = available_cpus()
+    threads = threads or max(1, len(cpus) // workers)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    # Load the model once; workers inherit it copy-on-write
+    started = time.perf_counter()
+    import embedding_service
+
+    if (embedding_service.SEARCH_CHUNK_FILES and embedding_service.SEARCH_INDEX == "hnsw"
+            and not embedding_service.HNSW_PATH):
+        raise SystemExit("EMBED_SEARCH_INDEX=hnsw needs EMBED_HNSW_PATH so workers load one saved graph "
+                         "instead of each building it; build it once with --workers 1")
+    embedding_service.load_model()
+    print(f"Model loaded in {time.perf_counter() - started:.1f}s; "
+          f"starting {workers} workers x {threads} threads on port {port}", flush=True)
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(host, port)
+    children: dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                run_worker(index, sock, threads, cpus)
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+        children[pid] = index
+
+    def shutdown(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    for index in range(workers):
+        spawn(index)
+
+    # Supervise: respawn crashed workers until asked to stop
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"Worker {index} (pid {pid}) exited with status {status}, respawning", flush=True)
+            spawn(index)
+    sock.close()
+
+
+def _post_batch(conn: http.client.HTTPConnection, texts: list[str]) -> int:
+    body = json.dumps({"texts": texts})
+    conn.request("POST", "/embed/batch", body=body, headers={
+        "Content-Type": "application/json",
+        "Accept": "application/octet-stream",
+    })
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def _ready_pid(port: int) -> int | None:
+    """Pid of the worker that answered /readyz on a fresh connection, if it is ready."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        conn.request("GET", "/readyz")
+        response = conn.getresponse()
+        body = json.loads(response.read())
+        return body.get("pid") if response.status == 200 else None
+    except (OSError, ValueError):
+        return None
+    finally:
+        conn.close()
+
+
+def wait_all_ready(port: int, workers: int, timeout: float) -> None:
+    """Wait until ``workers`` distinct workers have answered /readyz with 200.
+
+    Workers share one listening socket, so each round probes with several
+    concurrent connections to reach different workers.
+    """
+    ready: set[int] = set()
+    deadline = time.monotonic() + timeout
+    while len(ready) < workers:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"only {len(ready)} of {workers} workers on port {port} ready within {timeout}s")
+        probes = [None] * (2 * workers)
+
+        def probe(i: int) -> None:
+            probes[i] = _ready_pid(port)
+
+        threads = [threading.Thread(target=probe, args=(i,)) for i in range(len(probes))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ready.update(pid for pid in probes if pid is not None)
+        time.sleep(0.2)
+
+
+def bench(max_workers: int, port: int, duration: float, concurrency: int, batch_size: int) -> list[dict]:
+    """Throughput of 1..max_workers workers, each with cores/workers threads."""
+    from bench_embedding_service import NO_CACHE_ENV
+    from embedding_backends import load_corpus_texts
+
+    texts = load_corpus_texts()
+    cpus = len(available_cpus())
+    counts = sorted({1, max_workers, *(2 ** i for i in range(max_workers.bit_length()) if 2 ** i <= max_workers)})
+    env = {**os.environ, **NO_CACHE_ENV}
+    results = []
+    for workers in counts:
+        threads = max(1, cpus // workers)
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "serve_prefork.py"), "serve",
+             "--workers", str(workers), "--threads", str(threads), "--port", str(port)],
+            cwd=HERE,
+            env=env,
+        )
+        try:
+            # A single ready worker is not enough: its siblings would still answer 503
+            wait_all_ready(port, workers, timeout=300)
+            latencies: list[float] = []
+            done = 0
+            errors = 0
+            lock = threading.Lock()
+            deadline = time.monotonic() + duration
+
+            def client(seed: int) -> None:
+                nonlocal done, errors
+                rng = np.random.default_rng(seed)
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+                while time.monotonic() < deadline:
+                    picks = rng.integers(0, len(texts), batch_size)
+                    started = time.perf_counter()
+                    try:
+                        status = _post_batch(conn, [texts[i] for i in picks])
+                    except OSError:
+                        conn.close()
+                        status = None
+                    with lock:
+                        if status == 200:
+                            latencies.append((time.perf_counter() - started) * 1000)
+                            done += batch_size
+                        else:
+                            errors += 1
+
+            started = time.perf_counter()
+            clients = [threading.Thread(target=client, args=(seed,)) for seed in range(concurrency)]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=60)
+        results.append({
+            "workers": workers,
+            "threads_per_worker": threads,
+            "texts_per_s": done / elapsed,
+            "p50_ms": float(np.percentile(latencies, 50)) if latencies else None,
+            "p99_ms": float(np.percentile(latencies, 99)) if latencies else None,
+            "errors": errors,
+        })
+        print(json.dumps(results[-1]), flush=True)
+    baseline = results[0]["texts_per_s"]
+    print(f"\n{'workers':>8}{'threads':>9}{'texts/s':>12}{'speedup':>9}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for row in results:
+        print(f"{row['workers']:>8}{row['threads_per_worker']:>9}{row['texts_per_s']:>12.1f}"
+              f"{row['texts_per_s'] / baseline if baseline else 0.0:>9.2f}{row['p50_ms'] or 0.0:>10.1f}"
+              f"{row['p99_ms'] or 0.0:>10.1f}{row['errors']:>8}")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-fork embedding service")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--workers", type=int, default=len(available_cpus()))
+    serve_parser.add_argument("--threads", type=int, default=None, help="torch threads per worker")
+    bench_parser = sub.add_parser("bench")
+    bench_parser.add_argument("--max-workers", type=int, default=len(available_cpus()))
+    bench_parser.add_argument("--port", type=int, default=8765)
+    bench_parser.add_argument("--duration", type=float, default=20.0)
+    bench_parser.add_argument("--concurrency", type=int, default=16)
+    bench_parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, args.threads)
+    else:
+        bench(args.max_workers, args.port, args.duration, args.concurrency, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()